@@ -0,0 +1,147 @@
+"""
+Content-addressed cache of analysis verdicts.
+The key hashes the decoded frames together with the analysis parameters
+(threshold, region, decision rule version, face detector), so analysing the
+same frames again is a lookup while changing any parameter misses and
+recomputes. Entries are kept in an in-memory LRU and as JSON files under
+data/analysis/cache, which survive restarts and are shared by workers that
+see the same data/ directory. Pixels are hashed rather than files, so frames
+analysed in memory and their lossless copies on disk share entries.
+The disk tier is pruned to max_disk_entries files, dropping the least recently
+used first and any entry unused for max_age seconds.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import numpy as np
+
+import metrics
+
+
+def analysis_key(frames: Iterable[dict], parameters: dict) -> str:
+    """
+    sha256 over the parameters and, for every frame in order (base first), its
+    color, shape and pixels. frames are dicts as described in frames.py.
+    """
+    digest = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode("utf-8"))
+    for frame in frames:
+        image = np.ascontiguousarray(frame["image"])
+        digest.update(f"\0{frame['color']}\0{image.shape}\0".encode("utf-8"))
+        digest.update(image.data)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    def __init__(self, directory: str, max_entries: int = 256, enabled: bool = True,
+                 max_disk_entries: int = 10000, max_age: float = 30 * 86400.0):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.max_disk_entries = max_disk_entries
+        self.max_age = max_age
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Pruning lists the whole directory, so it runs once per this many writes
+        self._prune_every = max(1, max_disk_entries // 10)
+        self._writes_since_prune = 0
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+            self.prune()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                metrics.ANALYSIS_CACHE.labels(result="memory").inc()
+                return value
+        try:
+            with open(self._path(key), "r") as f:
+                value = json.load(f)
+        except FileNotFoundError:
+            metrics.ANALYSIS_CACHE.labels(result="miss").inc()
+            return None
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable analysis cache entry {key}: {e}")
+            metrics.ANALYSIS_CACHE.labels(result="miss").inc()
+            return None
+        metrics.ANALYSIS_CACHE.labels(result="disk").inc()
+        try:
+            # The file's mtime is its last use, for prune()
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: dict):
+        if not self.enabled:
+            return
+        self._remember(key, value)
+        # Written under a temporary name first so readers never see a partial file
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(value, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"⚠️ Failed to write analysis cache entry {key}: {e}")
+        with self._lock:
+            self._writes_since_prune += 1
+            due = self._writes_since_prune >= self._prune_every
+            if due:
+                self._writes_since_prune = 0
+        if due:
+            self.prune()
+
+    def prune(self) -> int:
+        """Deletes disk entries unused for max_age, then the least recently used beyond max_disk_entries."""
+        now = time.time()
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".json"):
+                        try:
+                            entries.append((entry.stat().st_mtime, entry.path))
+                        except OSError:
+                            pass
+        except OSError as e:
+            print(f"⚠️ Could not list analysis cache {self.directory}: {e}")
+            return 0
+        entries.sort(reverse=True)
+        stale = [path for i, (mtime, path) in enumerate(entries)
+                 if i >= self.max_disk_entries or now - mtime > self.max_age]
+        removed = 0
+        for path in stale:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                # Already removed by another worker
+                pass
+        if removed:
+            print(f"🧹 Pruned {removed} analysis cache entries from {self.directory}")
+        return removed
+
+    def _remember(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
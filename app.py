@@ -1,22 +1,34 @@
 import cv2
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from uuid import uuid4
 import os
+import socket
 import threading
+import time
+import asyncio
 import json
+import queue
+import random
 import subprocess
 import shutil
-from collections import defaultdict
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import uvicorn
 import ssl
 from typing import Dict, List, Any, Optional
-from utils import compare_all_frames
-import glob
+from utils import analysis_parameters, compare_frames, decide_injection, frame_detail, warmup
+from analysis_cache import AnalysisCache, analysis_key
+import frames as frame_store
+import metrics
+from sessions import SessionLimitExceeded, SessionRegistry, issue_resume_token, verify_resume_token
+from session_store import create_session_store
+from ingest import ChunkWriter
+import protocol
+from profiling import SamplingProfiler, SessionTimings, activate, current_timings, should_profile, stage
 import datetime
-import boto3
-from botocore.exceptions import ClientError
 
 app = FastAPI()
 
@@ -48,6 +60,11 @@ async def verify_api_key(x_api_key: str = Header(None)):
 def health_check():
     return {"status": "ok"}
 
+# Prometheus scrape endpoint (no authentication, like /health)
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Secure endpoint to get API key (for frontend use)
 @app.get("/api-key")
 async def get_api_key():
@@ -62,23 +79,87 @@ S3 configuration
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 S3_PREFIX = os.getenv("S3_PREFIX", "")
 AWS_REGION = os.getenv("AWS_REGION")
+# Point at a local S3 stand-in (MinIO, moto server) for testing
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_FLUSH_TIMEOUT = float(os.getenv("S3_FLUSH_TIMEOUT", "60"))
 
 s3_client = None
-if not S3_BUCKET_NAME:
-    print("ℹ️ S3 disabled: S3_BUCKET_NAME not set")
-if S3_BUCKET_NAME:
+# S3Uploader, started by init_s3()
+s3_uploader = None
+# Set once init_s3() has finished, whether or not the bucket is usable
+s3_ready = threading.Event()
+# Uploads requested while init_s3() was still validating the bucket; queued once it finishes
+S3_PENDING_MAX = int(os.getenv("S3_PENDING_MAX", "1000"))
+_s3_pending: List[tuple] = []
+_s3_pending_lock = threading.Lock()
+
+
+def init_s3():
+    """
+    Validates bucket access and starts the background uploader.
+    Runs off the event loop at startup, so neither the boto3 import nor the
+    head_bucket round trip delays boot; uploads requested meanwhile are buffered
+    and queued once it finishes.
+    """
     try:
-        s3_client = boto3.client("s3", region_name=AWS_REGION) if AWS_REGION else boto3.client("s3")
+        _connect_s3()
+    finally:
+        with _s3_pending_lock:
+            pending = list(_s3_pending)
+            _s3_pending.clear()
+            s3_ready.set()
+        if pending:
+            print(f"📤 Queueing {len(pending)} upload(s) requested during S3 initialization")
+        for submit, args, on_complete in pending:
+            if s3_uploader is not None:
+                _submit_upload(submit, *args, on_complete=on_complete)
+            elif on_complete:
+                # The caller saw the upload as queued; report it as failed
+                on_complete(None)
+
+
+def _connect_s3():
+    global s3_client, s3_uploader
+    if not S3_BUCKET_NAME:
+        print("ℹ️ S3 disabled: S3_BUCKET_NAME not set")
+        return
+    try:
+        import boto3
+        from s3_uploader import S3Uploader
+
+        client_kwargs: Dict[str, Any] = {}
+        if AWS_REGION:
+            client_kwargs["region_name"] = AWS_REGION
+        if S3_ENDPOINT_URL:
+            client_kwargs["endpoint_url"] = S3_ENDPOINT_URL
+        client = boto3.client("s3", **client_kwargs)
         # Validate bucket access
-        s3_client.head_bucket(Bucket=S3_BUCKET_NAME)
+        client.head_bucket(Bucket=S3_BUCKET_NAME)
         print(f"✅ Connected to S3 bucket: {S3_BUCKET_NAME}")
+        s3_uploader = S3Uploader.from_env(client, S3_BUCKET_NAME).start()
+        s3_client = client
     except Exception as e:
         print(f"⚠️ S3 initialization failed: {e}")
-        s3_client = None
 
 
 def s3_enabled() -> bool:
-    return s3_client is not None and bool(S3_BUCKET_NAME)
+    """True once the bucket is validated, and while it is still being validated (uploads are buffered)."""
+    return bool(S3_BUCKET_NAME) and (s3_client is not None or not s3_ready.is_set())
+
+
+def _submit_upload(submit: str, *args, on_complete=None) -> bool:
+    """Calls s3_uploader.<submit>(*args), or buffers the upload until init_s3() has finished."""
+    with _s3_pending_lock:
+        if not s3_ready.is_set():
+            if len(_s3_pending) >= S3_PENDING_MAX:
+                print(f"⚠️ S3 is still initializing and {S3_PENDING_MAX} uploads are waiting, dropping {args[1]}")
+                return False
+            _s3_pending.append((submit, args, on_complete))
+            return True
+    if s3_uploader is None:
+        # S3 initialization failed
+        return False
+    return getattr(s3_uploader, submit)(*args, on_complete=on_complete)
 
 
 def _s3_key(key: str) -> str:
@@ -88,38 +169,36 @@ def _s3_key(key: str) -> str:
     return key
 
 
-def upload_file_to_s3(file_path: str, key: str, content_type: Optional[str] = None, metadata: Optional[dict] = None) -> Optional[str]:
-    if not s3_enabled() or not os.path.exists(file_path):
-        return None
+def _s3_extra_args(content_type: Optional[str] = None, metadata: Optional[dict] = None) -> Dict[str, Any]:
     extra_args: Dict[str, Any] = {}
     if content_type:
         extra_args["ContentType"] = content_type
     if metadata:
         extra_args["Metadata"] = {k: str(v) for k, v in metadata.items() if v is not None}
-    try:
-        s3_client.upload_file(file_path, S3_BUCKET_NAME, _s3_key(key), ExtraArgs=extra_args)
-        print(f"✅ Uploaded to S3: s3://{S3_BUCKET_NAME}/{_s3_key(key)}")
-        return key
-    except ClientError as e:
-        print(f"⚠️ Failed to upload to S3: {e}")
+    return extra_args
+
+
+def upload_file_to_s3(file_path: str, key: str, content_type: Optional[str] = None, metadata: Optional[dict] = None,
+                      on_complete=None) -> Optional[str]:
+    """
+    Queues the file on the background uploader; returns the key once queued.
+    on_complete(size) is called from the uploader thread, with size None on failure.
+    """
+    if not s3_enabled() or not os.path.exists(file_path):
         return None
+    if _submit_upload("submit_file", file_path, _s3_key(key), _s3_extra_args(content_type, metadata),
+                      on_complete=on_complete):
+        return key
+    return None
 
 
 def upload_bytes_to_s3(content_bytes: bytes, key: str, content_type: Optional[str] = None, metadata: Optional[dict] = None) -> Optional[str]:
+    """Queues the bytes on the background uploader; returns the key once queued."""
     if not s3_enabled():
         return None
-    extra_args: Dict[str, Any] = {}
-    if content_type:
-        extra_args["ContentType"] = content_type
-    if metadata:
-        extra_args["Metadata"] = {k: str(v) for k, v in metadata.items() if v is not None}
-    try:
-        s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=_s3_key(key), Body=content_bytes, **extra_args)
-        print(f"✅ Uploaded object to S3: s3://{S3_BUCKET_NAME}/{_s3_key(key)}")
+    if _submit_upload("submit_bytes", content_bytes, _s3_key(key), _s3_extra_args(content_type, metadata)):
         return key
-    except ClientError as e:
-        print(f"⚠️ Failed to upload object to S3: {e}")
-        return None
+    return None
 
 
 def save_json_to_s3(obj: dict, key: str) -> Optional[str]:
@@ -137,6 +216,31 @@ MP4_FOLDER = os.path.join(UPLOAD_FOLDER, "mp4")
 COLOR_DATA_FOLDER = os.path.join(UPLOAD_FOLDER, "color_data")
 IMAGE_FOLDER = os.path.join(UPLOAD_FOLDER, "images")
 
+VISUALIZATION_FOLDER = os.path.join(UPLOAD_FOLDER, "visualization")
+
+# Analysis images: "never", "always" or "sampled" (VISUALIZATION_SAMPLE_RATE of sessions).
+# The verdict itself never waits for rendering; POST /visualize/{user_id} renders on demand.
+ANALYSIS_VISUALIZATION = os.getenv("ANALYSIS_VISUALIZATION", "sampled").lower()
+VISUALIZATION_SAMPLE_RATE = float(os.getenv("VISUALIZATION_SAMPLE_RATE", "0.01"))
+
+# Reflection analysis parameters; together with the frames they key the analysis cache
+ANALYSIS_THRESHOLD = int(os.getenv("ANALYSIS_THRESHOLD", "20"))
+ANALYSIS_REGION = os.getenv("ANALYSIS_REGION", "full").lower()
+# Verdicts of frames analysed before are reused from memory (LRU) or data/analysis/cache
+ANALYSIS_CACHE = os.getenv("ANALYSIS_CACHE", "true").lower() in ("1", "true", "yes")
+ANALYSIS_CACHE_ENTRIES = int(os.getenv("ANALYSIS_CACHE_ENTRIES", "256"))
+ANALYSIS_CACHE_DISK_ENTRIES = int(os.getenv("ANALYSIS_CACHE_DISK_ENTRIES", "10000"))
+ANALYSIS_CACHE_MAX_AGE_DAYS = float(os.getenv("ANALYSIS_CACHE_MAX_AGE_DAYS", "30"))
+
+# Start ffmpeg on the first WebM chunk and feed it chunks as they arrive
+STREAMING_TRANSCODE = os.getenv("STREAMING_TRANSCODE", "false").lower() in ("1", "true", "yes")
+STREAMING_TRANSCODE_TIMEOUT = float(os.getenv("STREAMING_TRANSCODE_TIMEOUT", "120"))
+# Chunks waiting for ffmpeg beyond this many bytes abort the stream; the archive then transcodes in full
+STREAMING_TRANSCODE_MAX_BUFFER = int(float(os.getenv("STREAMING_TRANSCODE_MAX_BUFFER_MB", "32")) * 1024 * 1024)
+
+# Append color events to data/color_data/<user>.jsonl as they arrive, for crash safety
+COLOR_EVENT_JOURNAL = os.getenv("COLOR_EVENT_JOURNAL", "false").lower() in ("1", "true", "yes")
+
 # Color mapping from hex to name
 COLOR_MAP = {
     "#00000000": "transparent",
@@ -155,16 +259,77 @@ os.makedirs(MP4_FOLDER, exist_ok=True)
 os.makedirs(COLOR_DATA_FOLDER, exist_ok=True)
 os.makedirs(IMAGE_FOLDER, exist_ok=True)
 
-# Thread-safe storage for user data
-user_data = defaultdict(lambda: {
-    "video_chunks": [],
-    "converted_mp4s": [],
-    "color_changes": [],
-    "aggregate_path": None,
-    "mime_type": None,
-    "num_chunks": 0
-})
-user_locks = defaultdict(threading.Lock)
+analysis_cache = AnalysisCache(os.path.join(UPLOAD_FOLDER, "analysis", "cache"), ANALYSIS_CACHE_ENTRIES, ANALYSIS_CACHE,
+                               ANALYSIS_CACHE_DISK_ENTRIES, ANALYSIS_CACHE_MAX_AGE_DAYS * 86400)
+
+# In-flight sessions: capped, and evicted once idle (SESSION_IDLE_TTL) or too old (SESSION_MAX_AGE)
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "500"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "600"))
+SESSION_MAX_AGE = float(os.getenv("SESSION_MAX_AGE", "3600"))
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "30"))
+
+# Recording progress, color events and jobs live in the session store. With
+# SESSION_STORE=sqlite, the worker processes of one host can pick up each other's sessions.
+session_store = create_session_store()
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+VIDEO_END_LEASE_SECONDS = float(os.getenv("VIDEO_END_LEASE_SECONDS", "600"))
+
+# Resume tokens let a client reattach to its session after a dropped connection.
+# The secret must be server-only: API_KEY ships in the frontend bundle, and anyone able to
+# sign tokens could take over another user's recording. Without a secret, resume is off.
+RESUME_TOKEN_SECRET = os.getenv("RESUME_TOKEN_SECRET")
+RESUME_TOKEN_TTL = float(os.getenv("RESUME_TOKEN_TTL", str(SESSION_MAX_AGE)))
+if RESUME_TOKEN_SECRET == API_KEY:
+    print("⚠️ RESUME_TOKEN_SECRET must not be the client-visible API_KEY; ignoring it")
+    RESUME_TOKEN_SECRET = None
+if not RESUME_TOKEN_SECRET:
+    print("⚠️⚠️ RESUME_TOKEN_SECRET is not set: session resume is DISABLED and a dropped connection "
+          "loses its recording. Set it to a random server-only value to enable resume.")
+
+
+async def run_store_io(func, *args):
+    """
+    Calls func(*args), which uses the session store, from the event loop. With a
+    store that can block (SQLite waits up to its busy_timeout under contention)
+    it runs in a thread so one slow write does not stall every socket.
+    """
+    if not session_store.blocking:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def discard_session_files(session, reason):
+    """Removes the partial recording of a session that never reached video_end."""
+    state = session_store.load_session(session.user_id)
+    if state and state.get("owner") != WORKER_ID:
+        # Another worker has taken the recording over; only the local copy goes away
+        return
+    session_store.delete_session(session.user_id)
+    session_store.clear_color_events(session.user_id)
+    paths = [_color_journal_path(session.user_id)]
+    if session.aggregate_path:
+        paths.append(session.aggregate_path)
+        paths.append(os.path.join(MP4_FOLDER, f"{session.user_id}_final_video.mp4"))
+    for path in paths:
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"⚠️ Could not remove {path}: {e}")
+
+
+sessions = SessionRegistry(MAX_SESSIONS, SESSION_IDLE_TTL, SESSION_MAX_AGE,
+                           on_evict=discard_session_files, store=session_store)
+metrics.SESSIONS.set_function(lambda: len(sessions))
+
+# Chunk ingest: writes run on this pool; above the high watermark chunk_ack asks the
+# client to throttle, above the max buffer the server stops reading the socket until it drains
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_HIGH_WATERMARK = int(float(os.getenv("INGEST_HIGH_WATERMARK_MB", "8")) * 1024 * 1024)
+INGEST_MAX_BUFFER = int(float(os.getenv("INGEST_MAX_BUFFER_MB", "32")) * 1024 * 1024)
+INGEST_MAX_REORDER = int(os.getenv("INGEST_MAX_REORDER", "8"))
+INGEST_STALL_TIMEOUT = float(os.getenv("INGEST_STALL_TIMEOUT", "30"))
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
 
 # WebSocket connection manager
 class ConnectionManager:
@@ -173,11 +338,22 @@ class ConnectionManager:
 
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
+        previous = self.active_connections.get(client_id)
         self.active_connections[client_id] = websocket
-
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
+        if previous is not None and previous is not websocket:
+            # A resumed connection replaces one the server hasn't noticed is gone
+            try:
+                await previous.close(code=4000, reason="Session resumed elsewhere")
+            except Exception:
+                pass
+
+    def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None) -> bool:
+        """Forgets the client's connection; with websocket, only if it is still the current one."""
+        current = self.active_connections.get(client_id)
+        if current is None or (websocket is not None and current is not websocket):
+            return False
+        del self.active_connections[client_id]
+        return True
 
     async def send_personal_message(self, message: dict, client_id: str):
         if client_id in self.active_connections:
@@ -185,6 +361,231 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+"""
+Post-processing worker pool
+"""
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", "2"))
+POSTPROCESS_MAX_PENDING = int(os.getenv("POSTPROCESS_MAX_PENDING", "16"))
+POSTPROCESS_JOB_HISTORY = int(os.getenv("POSTPROCESS_JOB_HISTORY", "1000"))
+
+# ffmpeg, OpenCV and boto3 release the GIL, so threads keep the event loop free
+postprocess_executor = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS, thread_name_prefix="postprocess")
+postprocess_slots = threading.BoundedSemaphore(POSTPROCESS_MAX_PENDING)
+post_processing_jobs: Dict[str, dict] = {}
+post_processing_lock = threading.Lock()
+
+
+def _prune_post_processing_jobs():
+    """Drops the oldest finished jobs once the history limit is exceeded."""
+    with post_processing_lock:
+        excess = len(post_processing_jobs) - POSTPROCESS_JOB_HISTORY
+        if excess <= 0:
+            return
+        for job_id in [j for j, job in post_processing_jobs.items() if job["status"] in ("done", "failed")][:excess]:
+            del post_processing_jobs[job_id]
+
+
+def _save_job(job: dict):
+    # Workers update jobs under post_processing_lock while requests read them
+    with post_processing_lock:
+        job = dict(job)
+    try:
+        session_store.save_job(job["job_id"], job)
+    except Exception as e:
+        print(f"⚠️ Failed to save job {job['job_id']} to the session store: {e}")
+
+
+def _run_post_processing(job_id: str, func, *args):
+    job = post_processing_jobs[job_id]
+    with post_processing_lock:
+        job["status"] = "running"
+        job["started_at"] = datetime.datetime.utcnow().isoformat()
+    _save_job(job)
+    try:
+        result = func(*args)
+        with post_processing_lock:
+            job["status"] = "done" if result is not False else "failed"
+            if isinstance(result, dict):
+                # Served by GET /analyze/jobs/{job_id}
+                job["result"] = result
+        return result
+    except Exception as e:
+        with post_processing_lock:
+            job["status"] = "failed"
+            job["error"] = str(e)
+        raise
+    finally:
+        with post_processing_lock:
+            job["finished_at"] = datetime.datetime.utcnow().isoformat()
+        _save_job(job)
+        metrics.JOBS_TOTAL.labels(status=job["status"]).inc()
+        postprocess_slots.release()
+
+
+def submit_post_processing(user_id: str, func, *args, kind: str = "video_end", job_id: Optional[str] = None):
+    """
+    Queues func(*args) on the post-processing pool.
+    Returns (job_id, future), or (None, None) when the pool is saturated.
+    """
+    if not postprocess_slots.acquire(blocking=False):
+        print(f"⚠️ Post-processing queue full, rejecting job for user {user_id}")
+        return None, None
+
+    _prune_post_processing_jobs()
+    job_id = job_id or str(uuid4())
+    with post_processing_lock:
+        post_processing_jobs[job_id] = {
+            "job_id": job_id,
+            "user_id": user_id,
+            "kind": kind,
+            "status": "queued",
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "worker": WORKER_ID
+        }
+    _save_job(post_processing_jobs[job_id])
+    try:
+        future = postprocess_executor.submit(_run_post_processing, job_id, func, *args)
+    except Exception as e:
+        # e.g. RuntimeError once the pool is shut down: nothing will run the job
+        print(f"❌ Could not queue post-processing for user {user_id}: {e}")
+        with post_processing_lock:
+            job = post_processing_jobs.pop(job_id)
+        _save_job(dict(job, status="failed", error=str(e)))
+        postprocess_slots.release()
+        return None, None
+    return job_id, future
+
+
+async def notify_post_processing_result(job_id: str, future, user_id: str):
+    """Waits for a post-processing job and pushes the outcome to the client."""
+    try:
+        result = await asyncio.wrap_future(future)
+        if result is False:
+            message = {"event": "video_failed", "data": {"job_id": job_id, "message": "Video processing failed"}}
+        else:
+            message = {"event": "video_processed", "data": {"job_id": job_id, "message": "Video processing complete"}}
+            if isinstance(result, dict):
+                message["data"]["is_injected"] = result.get("is_injected")
+    except Exception as e:
+        print(f"❌ Post-processing job {job_id} failed for user {user_id}: {e}")
+        message = {"event": "video_failed", "data": {"job_id": job_id, "message": str(e)}}
+
+    try:
+        await manager.send_personal_message(message, user_id)
+    except Exception as e:
+        print(f"⚠️ Could not deliver {message['event']} to user {user_id}: {e}")
+
+
+# Keep references to notification tasks so they are not garbage collected mid-flight
+notification_tasks = set()
+
+# MP4 transcode + archive upload run after the verdict, on their own low-priority pool
+ARCHIVE_WORKERS = int(os.getenv("ARCHIVE_WORKERS", "1"))
+ARCHIVE_NICENESS = int(os.getenv("ARCHIVE_NICENESS", "10"))
+archive_executor = ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS, thread_name_prefix="archive")
+archive_depth = metrics.QUEUE_DEPTH.labels(pool="archive")
+
+
+def submit_archive(func, *args):
+    """Queues background work (MP4 archive, frame persistence) on the archive pool."""
+    archive_depth.inc()
+    future = archive_executor.submit(func, *args)
+    future.add_done_callback(lambda _: archive_depth.dec())
+    return future
+
+
+# Visualizations take seconds per frame, so they get their own pool rather than
+# holding up frame persistence and MP4 archives queued behind them
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "1"))
+render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+render_depth = metrics.QUEUE_DEPTH.labels(pool="render")
+
+
+def submit_render(func, *args):
+    """Queues a visualization render on the render pool."""
+    render_depth.inc()
+    future = render_executor.submit(func, *args)
+    future.add_done_callback(lambda _: render_depth.dec())
+    return future
+
+
+metrics.QUEUE_DEPTH.labels(pool="postprocess").set_function(
+    lambda: sum(1 for job in list(post_processing_jobs.values()) if job["status"] in ("queued", "running"))
+)
+metrics.QUEUE_DEPTH.labels(pool="s3_upload").set_function(
+    lambda: (lambda stats: stats["queued"] + stats["in_flight"])(s3_uploader.stats()) if s3_uploader else 0
+)
+
+
+@app.on_event("shutdown")
+def shutdown_post_processing():
+    ingest_executor.shutdown(wait=True)
+    postprocess_executor.shutdown(wait=True)
+    archive_executor.shutdown(wait=True)
+    render_executor.shutdown(wait=True)
+    # Uploads queued by the pools above are flushed before exit
+    if s3_uploader:
+        s3_uploader.shutdown(timeout=S3_FLUSH_TIMEOUT)
+    session_store.close()
+
+
+# Readiness: S3 validation and the optional warmup run in the background after boot
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+startup_state = {"s3": "pending", "warmup": "pending" if WARMUP_ON_STARTUP else "skipped"}
+startup_tasks = set()
+
+
+def _warmup_worker(barrier):
+    # Hold each task until all have started so every pool thread loads its own detector
+    try:
+        barrier.wait(timeout=30)
+    except threading.BrokenBarrierError:
+        pass
+    warmup()
+
+
+async def _run_startup_step(name, awaitable):
+    started = time.perf_counter()
+    try:
+        await awaitable
+        startup_state[name] = "done"
+        print(f"✅ Startup step {name} finished in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        # A failed step is logged but does not keep the instance out of rotation
+        startup_state[name] = "failed"
+        print(f"⚠️ Startup step {name} failed: {e}")
+
+
+async def initialize_in_background():
+    loop = asyncio.get_running_loop()
+    steps = [_run_startup_step("s3", loop.run_in_executor(None, init_s3))]
+    if WARMUP_ON_STARTUP:
+        barrier = threading.Barrier(POSTPROCESS_WORKERS)
+        warmups = [loop.run_in_executor(postprocess_executor, _warmup_worker, barrier) for _ in range(POSTPROCESS_WORKERS)]
+        steps.append(_run_startup_step("warmup", asyncio.gather(*warmups)))
+    await asyncio.gather(*steps)
+
+
+@app.on_event("startup")
+async def start_background_initialization():
+    for coroutine in (initialize_in_background(), sessions.reap_forever(SESSION_REAP_INTERVAL)):
+        task = asyncio.create_task(coroutine)
+        startup_tasks.add(task)
+        task.add_done_callback(startup_tasks.discard)
+
+
+# Readiness probe: 503 until S3 validation and warmup have finished (no authentication required)
+@app.get("/ready")
+def readiness_check():
+    if "pending" in startup_state.values():
+        return JSONResponse(status_code=503, content={"status": "starting", "steps": startup_state})
+    return {"status": "ready", "steps": startup_state}
+
+@app.get("/sessions/stats")
+async def session_stats(api_key: str = Depends(verify_api_key)):
+    """Session count and approximate memory held by in-flight sessions."""
+    return sessions.memory_report()
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     # Check for API key in query parameters for WebSocket
@@ -193,41 +594,145 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.close(code=4001, reason="Invalid API key")
         return
     
-    user_id = str(uuid4())
+    resume_token = websocket.query_params.get("resume_token")
+    resumed_id = verify_resume_token(resume_token, RESUME_TOKEN_SECRET) if resume_token and RESUME_TOKEN_SECRET else None
+    if resume_token and resumed_id is None:
+        print("⚠️ Invalid or expired resume token, starting a new session")
+    if resumed_id:
+        await run_store_io(drop_stale_session, resumed_id)
+
+    user_id = resumed_id or str(uuid4())
+    try:
+        session = await run_store_io(sessions.get_or_create, user_id)
+    except SessionLimitExceeded as e:
+        print(f"⚠️ Rejecting connection: {e}")
+        await websocket.close(code=1013, reason="Server busy, please retry")
+        return
+
     await manager.connect(websocket, user_id)
+    metrics.ACTIVE_CONNECTIONS.inc()
     
     # Send user_id to client
-    await websocket.send_json({"event": "user_id", "data": {"user_id": user_id}})
-    print(f"✅ User connected: {user_id}")
+    # Also advertises the binary chunk framing this server accepts
+    await websocket.send_json({"event": "user_id", "data": {
+        "user_id": user_id,
+        "resume_token": issue_resume_token(user_id, RESUME_TOKEN_SECRET, RESUME_TOKEN_TTL) if RESUME_TOKEN_SECRET else None,
+        **protocol.advertisement(),
+    }})
+    if resumed_id:
+        # The client re-sends every chunk after last_sequence
+        resumed = await resume_progress(session)
+        await websocket.send_json({"event": "session_resumed", "data": resumed})
+        metrics.SESSIONS_RESUMED.inc()
+        print(f"🔁 User reconnected: {user_id} (last chunk {resumed['last_sequence']}, {resumed['offset']} bytes)")
+    else:
+        print(f"✅ User connected: {user_id}")
     
     try:
+        # Metadata of a video_chunk whose binary frame has not arrived yet
+        chunk_envelope = None
         while True:
             # Receive message from client
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            if message.get("bytes") is not None:
+                binary_data = message["bytes"]
+                if chunk_envelope is None and protocol.is_framed(binary_data):
+                    # Single-message chunk: header, MIME type and payload in one frame
+                    try:
+                        _, chunk_data, binary_data = protocol.decode_frame(binary_data)
+                    except protocol.FrameError as e:
+                        print(f"⚠️ Dropping invalid chunk frame from user {user_id}: {e}")
+                        continue
+                    metrics.CHUNK_MESSAGES.labels(framing="binary").inc()
+                else:
+                    chunk_data = chunk_envelope or {}
+                    metrics.CHUNK_MESSAGES.labels(framing="json").inc()
+                chunk_envelope = None
+                sequence = chunk_data.get("sequence")
+                if not _valid_sequence(sequence):
+                    print(f"⚠️ Rejecting chunk with invalid sequence {sequence!r} from user {user_id}")
+                    await manager.send_personal_message(
+                        {"event": "chunk_rejected", "data": {"sequence": sequence,
+                                                             "message": "sequence must be a non-negative integer"}},
+                        user_id)
+                    continue
+                ack = await run_store_io(handle_video_chunk, chunk_data, binary_data, user_id)
+                if ack:
+                    await manager.send_personal_message({"event": "chunk_ack", "data": ack}, user_id)
+                    await wait_for_ingest(user_id)
+                continue
+
+            data = json.loads(message.get("text") or "{}")
             event = data.get("event")
             
             if event == "video_start":
                 handle_video_start(data.get("data", {}))
             
             elif event == "color_change":
-                handle_color_change(data.get("data", {}), user_id)
+                await run_store_io(handle_color_change, data.get("data", {}), user_id)
             
             elif event == "video_chunk":
-                # For binary data, we need to receive bytes
-                binary_data = await websocket.receive_bytes()
-                handle_video_chunk(data.get("data", {}), binary_data, user_id)
+                # Legacy framing: the chunk bytes follow in the next binary message
+                chunk_envelope = data.get("data", {})
             
             elif event == "video_end":
-                handle_video_end(data.get("data", {}), user_id)
-                # Send response back to client
+                job_id, future = await run_store_io(submit_post_processing, user_id, handle_video_end,
+                                                    data.get("data", {}), user_id)
+                if job_id is None:
+                    await manager.send_personal_message(
+                        {"event": "video_failed", "data": {"message": "Server busy, please retry"}},
+                        user_id
+                    )
+                    continue
+
                 await manager.send_personal_message(
-                    {"event": "video_processed", "data": {"message": "Video processing complete"}},
+                    {"event": "video_processing", "data": {"job_id": job_id}},
                     user_id
                 )
+                # video_processed is pushed once the worker finishes
+                task = asyncio.create_task(notify_post_processing_result(job_id, future, user_id))
+                notification_tasks.add(task)
+                task.add_done_callback(notification_tasks.discard)
     
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
         print(f"❌ User disconnected: {user_id}")
+    finally:
+        metrics.ACTIVE_CONNECTIONS.dec()
+        # A resumed connection may already have replaced this one and owns the session now
+        if manager.disconnect(user_id, websocket):
+            # A recording interrupted before video_end is kept until the reaper evicts it,
+            # so the client can resume it within SESSION_IDLE_TTL
+            session = sessions.get(user_id)
+            if session is not None and not session.recording:
+                sessions.remove(user_id)
+
+def drop_stale_session(user_id):
+    """Forgets a local copy of a session whose recording another worker has continued since."""
+    session = sessions.get(user_id)
+    state = session_store.load_session(user_id)
+    if session is not None and state and state.get("owner") != WORKER_ID:
+        sessions.remove(user_id)
+        session.close()
+
+async def resume_progress(session):
+    """What a resumed client needs to continue: the last chunk on disk and the file size."""
+    writer = session.writer
+    if writer is not None:
+        # Chunks still queued for the writer count as received
+        await asyncio.get_running_loop().run_in_executor(None, writer.flush)
+        last_sequence, offset = writer.persisted_sequence, writer.bytes_written
+    else:
+        last_sequence, offset = session.persisted_sequence, session.bytes_written
+    return {
+        "user_id": session.user_id,
+        "recording": session.recording,
+        "last_sequence": last_sequence,
+        "offset": offset,
+        "num_chunks": session.num_chunks,
+    }
 
 def handle_video_start(data):
     user_id = data.get("user_id")
@@ -235,7 +740,11 @@ def handle_video_start(data):
     print(f"✅ start time: {start_time}")
 
 def handle_color_change(data, user_id):
-    """Stores color change events in a JSON file per user and mirrors to S3."""
+    """
+    Records a color change event in the session store.
+    With COLOR_EVENT_JOURNAL enabled the event is also appended to a JSONL journal.
+    The JSON file and its S3 copy are written once, on video_end.
+    """
     previous_color = data.get("previousColor")
     new_color = data.get("newColor")
     timestamp = data.get("timestamp")
@@ -248,26 +757,65 @@ def handle_color_change(data, user_id):
     previous_color_name = COLOR_MAP.get(previous_color, previous_color)
     new_color_name = COLOR_MAP.get(new_color, new_color)
 
+    entry = {
+        "previous_color": previous_color_name,
+        "new_color": new_color_name,
+        "timestamp": timestamp,
+        "video_start_time": video_start_time
+    }
+
+    session = sessions.get_or_create(user_id)
+    with session.lock:
+        session_store.append_color_event(user_id, entry)
+        if COLOR_EVENT_JOURNAL:
+            with open(_color_journal_path(user_id), "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    print(f"🎨 Color Change Logged: {previous_color_name} → {new_color_name} at {timestamp} for {user_id}")
+
+def _color_journal_path(user_id):
+    return os.path.join(COLOR_DATA_FOLDER, f"{user_id}.jsonl")
+
+def load_color_events(user_id):
+    """
+    Returns the user's color events: the session store, else the JSONL journal
+    (e.g. after a restart with the in-memory store), else a previously materialized JSON file.
+    """
+    events = session_store.color_events(user_id)
+    if events:
+        return events
+
+    journal_path = _color_journal_path(user_id)
+    if os.path.exists(journal_path):
+        with open(journal_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn last line from a crash mid-write
+                    print(f"⚠️ Skipping corrupt journal line for user {user_id}")
+        return events
+
     user_color_file = os.path.join(COLOR_DATA_FOLDER, f"{user_id}.json")
+    if os.path.exists(user_color_file):
+        with open(user_color_file, "r") as f:
+            return json.load(f)
+    return events
 
-    with user_locks[user_id]:
-        color_data = []
-        if os.path.exists(user_color_file):
-            with open(user_color_file, "r") as f:
-                color_data = json.load(f)
-
-        entry = {
-            "previous_color": previous_color_name,
-            "new_color": new_color_name,
-            "timestamp": timestamp,
-            "video_start_time": video_start_time
-        }
-        color_data.append(entry)
+def save_color_events(user_id, color_data):
+    """Materializes the color events as <user>.json and mirrors it to S3 once."""
+    user_color_file = os.path.join(COLOR_DATA_FOLDER, f"{user_id}.json")
+    with open(user_color_file, "w") as f:
+        json.dump(color_data, f, indent=4)
 
-        with open(user_color_file, "w") as f:
-            json.dump(color_data, f, indent=4)
+    journal_path = _color_journal_path(user_id)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
 
-    # Also mirror the aggregated color data file to S3 to match download_data structure
+    # Mirror the aggregated color data file to S3 to match download_data structure
     if s3_enabled():
         try:
             s3_key = f"download_data/{user_id}/color_data/{user_id}.json"
@@ -275,8 +823,6 @@ def handle_color_change(data, user_id):
         except Exception as e:
             print(f"⚠️ Failed to upload color data JSON to S3: {e}")
 
-    print(f"🎨 Color Change Logged: {previous_color_name} → {new_color_name} at {timestamp} for {user_id}")
-
 def _ext_from_mime(mime: Optional[str]) -> str:
     if not mime:
         # Prefer mp4 as safer default for iOS Safari when mime is missing
@@ -290,25 +836,42 @@ def _ext_from_mime(mime: Optional[str]) -> str:
     return ".mp4"
 
 
+def _publish_progress(user_id, session):
+    """ChunkWriter callback that shares the recording's progress through the session store."""
+    def on_write(writer):
+        session.persisted_sequence = writer.persisted_sequence
+        session.bytes_written = writer.bytes_written
+        session_store.save_session(user_id, session.to_state(WORKER_ID))
+    return on_write
+
+def _valid_sequence(sequence) -> bool:
+    """Chunks may omit the sequence number; when present it must be a non-negative int."""
+    return sequence is None or (isinstance(sequence, int) and not isinstance(sequence, bool) and sequence >= 0)
+
 def handle_video_chunk(data, binary_data, user_id):
-    """Handles video chunk received from the client."""
+    """
+    Hands a video chunk to the session's ChunkWriter, which writes it in sequence
+    order off the event loop. Returns the chunk_ack payload for the client.
+    """
     start_time = data.get("startTime")
     end_time = data.get("endTime")
     mime_type = data.get("mimeType")
     sequence = data.get("sequence")
 
     if not user_id or binary_data is None:
-        return
+        return None
 
+    started = time.perf_counter()
+    session = sessions.get_or_create(user_id)
     # Append the binary chunk to a single aggregate recording file
-    with user_locks[user_id]:
+    with session.lock:
         ext = _ext_from_mime(mime_type)
-        aggregate_path = user_data[user_id].get("aggregate_path")
+        aggregate_path = session.aggregate_path
         if not aggregate_path:
             aggregate_path = os.path.join(CHUNKS_FOLDER, f"{user_id}_recording{ext}")
-            user_data[user_id]["aggregate_path"] = aggregate_path
-            user_data[user_id]["mime_type"] = mime_type
-            user_data[user_id]["num_chunks"] = 0
+            session.aggregate_path = aggregate_path
+            session.mime_type = mime_type
+            session.num_chunks = 0
             # If a file exists with different extension from earlier runs, remove it
             for old_ext in [".mp4", ".webm"]:
                 old_path = os.path.join(CHUNKS_FOLDER, f"{user_id}_recording{old_ext}")
@@ -317,45 +880,157 @@ def handle_video_chunk(data, binary_data, user_id):
                         os.remove(old_path)
                     except Exception:
                         pass
-
-        # Append bytes to the aggregate file; do not create per-chunk files
-        with open(aggregate_path, "ab") as f:
-            f.write(binary_data)
-
-        user_data[user_id]["num_chunks"] += 1
-        print(f"Chunk appended for user {user_id}: {aggregate_path} (+{len(binary_data)} bytes), chunks={user_data[user_id]['num_chunks']}")
+            if STREAMING_TRANSCODE and ext == ".webm":
+                output_video_path = os.path.join(MP4_FOLDER, f"{user_id}_final_video.mp4")
+                session.transcoder = StreamingTranscoder(output_video_path, mime_type)
+            session.writer = ChunkWriter(aggregate_path, ingest_executor, session.transcoder, INGEST_MAX_REORDER,
+                                         on_write=_publish_progress(user_id, session))
+            session_store.save_session(user_id, session.to_state(WORKER_ID))
+        elif session.writer is None:
+            # Recording started on another worker: continue its file after the last persisted chunk.
+            # The streaming transcoder only saw the other worker's bytes, so video_end transcodes in full.
+            session.writer = ChunkWriter(aggregate_path, ingest_executor, None, INGEST_MAX_REORDER,
+                                         first_sequence=session.persisted_sequence + 1,
+                                         offset=session.bytes_written,
+                                         on_write=_publish_progress(user_id, session))
+
+        # Chunks are appended to the aggregate file in sequence order; no per-chunk files
+        writer = session.writer
+        if writer.submit(sequence, binary_data):
+            session.num_chunks += 1
+        else:
+            print(f"⚠️ Ignoring duplicate or late chunk {sequence} for user {user_id}")
+        session.receive_seconds += time.perf_counter() - started
+
+    metrics.CHUNKS_RECEIVED.inc()
+    metrics.CHUNK_BYTES.inc(len(binary_data))
+    print(f"Chunk queued for user {user_id}: {aggregate_path} (+{len(binary_data)} bytes), chunks={session.num_chunks}")
+    return {
+        "sequence": sequence,
+        "persisted_sequence": writer.persisted_sequence,
+        "buffered_bytes": writer.buffered_bytes,
+        "throttle": writer.buffered_bytes > INGEST_HIGH_WATERMARK
+    }
+
+async def wait_for_ingest(user_id):
+    """
+    Stops reading from the client while its writer is over INGEST_MAX_BUFFER,
+    so a slow disk pushes back through TCP instead of growing memory.
+    """
+    session = sessions.get(user_id)
+    writer = session.writer if session else None
+    if writer is None or writer.buffered_bytes <= INGEST_MAX_BUFFER:
+        return
+    deadline = time.monotonic() + INGEST_STALL_TIMEOUT
+    while writer.buffered_bytes > INGEST_HIGH_WATERMARK and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
 
 def handle_video_end(data, user_id):
-    """Handles video end event and merges chunks for a specific user."""
+    """
+    Handles video end event for a specific user.
+    Frames are decoded straight from the aggregate recording and analyzed first;
+    the MP4 transcode and S3 archive run afterwards on the archive pool.
+    Runs on the post-processing pool; returns False when nothing could be processed.
+    """
     if not user_id:
-        return
+        return False
 
-    with user_locks[user_id]:
-        aggregate_path = user_data[user_id].get("aggregate_path")
-        if not aggregate_path or not os.path.exists(aggregate_path):
-            print(f"⚠️ No aggregate recording found for user {user_id} on video_end")
-            return
+    # Only one worker may process a recording, even if video_end is delivered twice
+    lease = f"video_end:{user_id}"
+    if not session_store.acquire_lease(lease, WORKER_ID, VIDEO_END_LEASE_SECONDS):
+        print(f"⚠️ video_end for user {user_id} is already being processed by another worker")
+        return False
+
+    timings = SessionTimings()
+    profiler = SamplingProfiler().start() if should_profile() else None
+    # Set once the session hands the recording over; archived even if the analysis fails
+    archive = None
+    try:
+        with activate(timings):
+            # Hydrates from the session store when the chunks went to another worker
+            try:
+                session = sessions.get_or_create(user_id)
+            except SessionLimitExceeded:
+                print(f"⚠️ No session slot for user {user_id} on video_end")
+                return False
+
+            with session.lock:
+                aggregate_path = session.aggregate_path
+                writer = session.writer
+                if writer is not None:
+                    # Waits for buffered and out-of-order chunks to be written
+                    if not writer.close():
+                        print(f"⚠️ Aggregate recording for user {user_id} may be incomplete")
+                if not aggregate_path or not os.path.exists(aggregate_path):
+                    print(f"⚠️ No aggregate recording found for user {user_id} on video_end")
+                    return False
+                # Moved aside so that a new recording for this user starts a fresh file
+                # while this one is extracted and archived outside the session lock
+                root, ext = os.path.splitext(aggregate_path)
+                taken_path = f"{root}.{uuid4().hex[:8]}{ext}"
+                os.replace(aggregate_path, taken_path)
+                aggregate_path = taken_path
+
+                num_chunks = session.num_chunks
+                mime_type = session.mime_type
+                transcoder = session.transcoder
+                timings.add("receive", session.receive_seconds + (writer.write_seconds if writer else 0.0))
+
+                color_data = load_color_events(user_id)
+                if color_data:
+                    save_color_events(user_id, color_data)
+                session_store.clear_color_events(user_id)
+
+                # The archive takes over the recording; the session is ready for another one
+                session.reset()
+                session_store.delete_session(user_id)
+                archive = (aggregate_path, mime_type, transcoder, num_chunks)
+
+                metrics.CHUNKS_PER_SESSION.observe(num_chunks)
+
+            # Outside the session lock: chunk and color handlers take it, inline on the
+            # event loop with the in-memory store.
+            # Fast path: decode the target frames from the recording itself
+            with stage("extract"):
+                frames = extract_frames(user_id, aggregate_path, color_data, by_time=True)
+            result = analyze_video(user_id, timings, frames)
+    finally:
+        session_store.release_lease(lease, WORKER_ID)
+        if profiler:
+            profiler.stop()
+            save_profile(user_id, profiler)
+        if archive is not None:
+            # The MP4 is only needed for the archive, so it no longer delays the verdict.
+            # Also finishes the streaming transcoder, which would leak if the analysis raised.
+            submit_archive(archive_recording, user_id, *archive, timings)
+    return result
 
-        num_chunks = user_data[user_id].get("num_chunks", 0)
+def archive_recording(user_id, aggregate_path, mime_type=None, transcoder=None, num_chunks=0, timings=None):
+    """Builds <user>_final_video.mp4 from the aggregate recording and uploads it to S3."""
+    timings = timings or SessionTimings()
+    try:
         ext = os.path.splitext(aggregate_path)[1].lower()
         output_video_path = os.path.join(MP4_FOLDER, f"{user_id}_final_video.mp4")
 
-        if ext == ".mp4":
-            shutil.copyfile(aggregate_path, output_video_path)
-        else:
-            if not convert_webm_to_mp4(aggregate_path, output_video_path):
+        with activate(timings), stage("transcode"):
+            if ext == ".mp4":
+                shutil.copyfile(aggregate_path, output_video_path)
+            elif transcoder and transcoder.finish():
+                print(f"✅ Streaming transcode finished for user {user_id}")
+            elif not convert_webm_to_mp4(aggregate_path, output_video_path, mime_type, niceness=ARCHIVE_NICENESS):
                 print(f"❌ Failed to convert aggregate WebM to MP4 for user {user_id}")
-                return
-
-        # Clear user data
-        user_data[user_id]["video_chunks"].clear()
-        user_data[user_id]["aggregate_path"] = None
-        user_data[user_id]["mime_type"] = None
-        user_data[user_id]["num_chunks"] = 0
+                return False
 
         print(f"✅ Video created for user {user_id}: {output_video_path}")
+        upload_queued_at = time.perf_counter()
+
+        def on_uploaded(size):
+            # Queue wait included: this is how long the archive took to land in S3
+            timings.add("upload", time.perf_counter() - upload_queued_at)
+            save_session_timings(user_id, timings)
+
         # Upload merged MP4 to S3 in desired folder structure
-        upload_file_to_s3(
+        queued = upload_file_to_s3(
             output_video_path,
             key=f"download_data/{user_id}/videos/{user_id}.mp4",
             content_type="video/mp4",
@@ -363,30 +1038,149 @@ def handle_video_end(data, user_id):
                 "user_id": user_id,
                 "created_at": datetime.datetime.utcnow().isoformat(),
                 "num_chunks": num_chunks
-            }
+            },
+            on_complete=on_uploaded
         )
-        extract_frames(user_id, output_video_path)
-        # res=analyze_video(user_id)
+        if not queued:
+            save_session_timings(user_id, timings)
+        os.remove(aggregate_path)
         cleanup_user_files(user_id)
+        return True
+    except Exception as e:
+        print(f"❌ Archiving failed for user {user_id}: {e}")
+        return False
 
-def convert_webm_to_mp4(webm_path, mp4_path):
-    """Converts WebM to MP4 using ffmpeg."""
-    try:
+def _can_stream_copy(mime_type):
+    """H.264 video can be remuxed into MP4 without re-encoding."""
+    mime = (mime_type or "").lower()
+    return "h264" in mime or "avc1" in mime
+
+def _ffmpeg_codec_args(mime_type, stream_copy=None):
+    if stream_copy is None:
+        stream_copy = _can_stream_copy(mime_type)
+    if stream_copy:
+        video_args = ["-c:v", "copy"]
+    else:
+        video_args = ["-c:v", "libx264", "-preset", "fast", "-crf", "23"]
+    return video_args + ["-c:a", "aac", "-strict", "experimental"]
+
+def _lower_priority(niceness):
+    if not niceness or not hasattr(os, "nice"):
+        return None
+    return lambda: os.nice(niceness)
+
+def convert_webm_to_mp4(webm_path, mp4_path, mime_type=None, niceness=0):
+    """
+    Converts WebM to MP4 using ffmpeg.
+    H.264 input is remuxed with stream copy; if that fails it is re-encoded.
+    A positive niceness runs ffmpeg at lower CPU priority.
+    """
+    attempts = [True, False] if _can_stream_copy(mime_type) else [False]
+    for stream_copy in attempts:
+        try:
+            command = [
+                "ffmpeg",
+                "-y", "-i", webm_path,
+                *_ffmpeg_codec_args(mime_type, stream_copy),
+                mp4_path
+            ]
+            subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           preexec_fn=_lower_priority(niceness))
+            return True
+        except subprocess.CalledProcessError as e:
+            print(f"❌ FFmpeg error: {e.stderr.decode('utf-8')}")
+    return False
+
+class StreamingTranscoder:
+    """
+    Runs ffmpeg from the first chunk onwards, reading the WebM stream from stdin.
+    Chunks are written by a feeder thread so a slow encoder never blocks the caller;
+    finish() closes the pipe and waits for ffmpeg to write the MP4 trailer.
+    If ffmpeg falls more than max_buffer bytes behind, the stream is aborted and
+    finish() returns False, so archive_recording converts the aggregate WebM instead.
+    """
+
+    def __init__(self, mp4_path, mime_type=None, max_buffer=STREAMING_TRANSCODE_MAX_BUFFER):
+        self.mp4_path = mp4_path
+        self.max_buffer = max_buffer
+        self.failed = False
+        self._queue = queue.Queue()
+        self._buffered = 0
+        self._buffer_lock = threading.Lock()
+        self._stderr = tempfile.TemporaryFile()
         command = [
             "ffmpeg",
-            "-y", "-i", webm_path,
-            "-c:v", "libx264",
-            "-preset", "fast",
-            "-crf", "23",
-            "-c:a", "aac",
-            "-strict", "experimental",
+            "-y", "-loglevel", "error",
+            "-i", "pipe:0",
+            *_ffmpeg_codec_args(mime_type),
             mp4_path
         ]
-        subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+        self._feeder = threading.Thread(target=self._feed_loop, name="ffmpeg-feeder", daemon=True)
+        self._feeder.start()
+
+    def _feed_loop(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if not self.failed:
+                try:
+                    self._process.stdin.write(chunk)
+                except (BrokenPipeError, OSError) as e:
+                    if not self.failed:
+                        print(f"⚠️ Streaming transcode pipe closed: {e}")
+                    self.failed = True
+            with self._buffer_lock:
+                self._buffered -= len(chunk)
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+
+    def feed(self, chunk):
+        if self.failed:
+            return
+        with self._buffer_lock:
+            overflow = self._buffered + len(chunk) > self.max_buffer
+            if not overflow:
+                self._buffered += len(chunk)
+                self._queue.put(chunk)
+        if overflow:
+            print(f"⚠️ ffmpeg fell {self._buffered} bytes behind on {self.mp4_path}, "
+                  f"aborting the streaming transcode; the archive will convert the full recording")
+            # Killing ffmpeg unblocks the feeder, which then drops the queued chunks
+            self.failed = True
+            self._process.kill()
+
+    def finish(self, timeout=STREAMING_TRANSCODE_TIMEOUT):
+        """Closes stdin and waits for ffmpeg; returns True when the MP4 was written."""
+        self._queue.put(None)
+        self._feeder.join()
+        try:
+            returncode = self._process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+            print(f"❌ Streaming transcode timed out for {self.mp4_path}")
+            return False
+        finally:
+            self._stderr.seek(0)
+            errors = self._stderr.read().decode("utf-8", errors="replace")
+            self._stderr.close()
+
+        if returncode != 0 or self.failed:
+            print(f"❌ Streaming transcode failed ({returncode}): {errors}")
+            return False
         return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ FFmpeg error: {e.stderr.decode('utf-8')}")
-        return False
+
+    def abort(self):
+        """Stops ffmpeg without waiting for the output."""
+        self.failed = True
+        self._queue.put(None)
+        self._process.kill()
+        self._process.wait()
+        self._stderr.close()
 
 def merge_mp4_chunks(mp4_chunks, output_path):
     """Merges MP4 chunks into a single video file using FFmpeg."""
@@ -431,114 +1225,216 @@ def cleanup_user_files(user_id):
 
     print(f"🗑️ Deleted all temporary files for user {user_id}")
 
-def extract_frames(user_id, video_path):
-    """Extracts frames from the final video at specified timestamps."""
-    user_color_file = os.path.join(COLOR_DATA_FOLDER, f"{user_id}.json")
-    user_image_folder = os.path.join(IMAGE_FOLDER, user_id)
-    os.makedirs(user_image_folder, exist_ok=True)
+def read_frames_at(video_path, target_frames):
+    """
+    Decodes the video once and returns {frame_number: frame} for the requested frames.
+    Frames before a target are only grabbed, and decoding stops after the last target.
+    """
+    targets = sorted({t for t in target_frames if t >= 0})
+    frames = {}
+    if not targets:
+        return frames
 
-    if not os.path.exists(user_color_file):
-        print(f"⚠️ No color data found for user {user_id}")
-        return
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"❌ OpenCV Error: Unable to open {video_path}")
+        return frames
 
-    with open(user_color_file, "r") as f:
-        color_data = json.load(f)
+    try:
+        next_index = 0
+        frame_number = 0
+        last_target = targets[-1]
+        while frame_number <= last_target:
+            # grab() advances without converting the frame; only targets are retrieved
+            if not cap.grab():
+                break
+            if frame_number == targets[next_index]:
+                success, frame = cap.retrieve()
+                if success:
+                    frames[frame_number] = frame
+                next_index += 1
+            frame_number += 1
+    finally:
+        cap.release()
+
+    return frames
+
+def read_frames_at_times(video_path, target_times_ms):
+    """
+    Decodes the video once and returns {target_ms: frame}, picking for each target
+    the frame being displayed at that time. Uses container timestamps, so it works on
+    MediaRecorder WebM whose frame count and frame rate metadata are unreliable.
+    """
+    targets = sorted({t for t in target_times_ms if t >= 0})
+    frames = {}
+    if not targets:
+        return frames
 
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print(f"❌ OpenCV Error: Unable to open {video_path}")
-        return
+        return frames
+
+    try:
+        next_index = 0
+        previous_pts = None
+        frame_duration = 1000.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0)
+        while next_index < len(targets):
+            if not cap.grab():
+                break
+            pts = cap.get(cv2.CAP_PROP_POS_MSEC)
+            if previous_pts is not None and pts > previous_pts:
+                frame_duration = pts - previous_pts
+            previous_pts = pts
+
+            # This frame covers [pts, pts + frame_duration); retrieve once for all targets in it
+            frame = None
+            while next_index < len(targets) and targets[next_index] < pts + frame_duration:
+                if frame is None:
+                    success, frame = cap.retrieve()
+                    if not success:
+                        frame = None
+                if frame is not None:
+                    frames[targets[next_index]] = frame
+                next_index += 1
+    finally:
+        cap.release()
+
+    return frames
+
+def extract_frames(user_id, video_path, color_data=None, *, by_time):
+    """
+    Extracts frames from the final video at specified timestamps.
+    color_data defaults to the user's recorded color events.
+    by_time=True locates frames by timestamp, for recordings straight from the client
+    (the aggregate WebM/MP4), whose frame metadata is unreliable; by_time=False seeks
+    by frame number, for the transcoded <user>_final_video.mp4.
+    Returns the decoded frames with their event metadata (see frames.py), in capture
+    order; they are persisted to disk and S3 in the background.
+    """
+    if color_data is None:
+        color_data = load_color_events(user_id)
+
+    if not color_data:
+        print(f"⚠️ No color data found for user {user_id}")
+        return []
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"❌ OpenCV Error: Unable to open {video_path}")
+        return []
     
     fps = cap.get(cv2.CAP_PROP_FPS)
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
     print(f"Video FPS: {fps}, Total frames: {total_frames}")
 
+    targets = []
     for entry in color_data:
         timestamp = entry["timestamp"]
         video_start = entry["video_start_time"]
-        previous_color = entry["new_color"]
         
         # Calculate relative time from video start in milliseconds
         relative_time_ms = timestamp - video_start
-        target_frame = int((relative_time_ms / 1000) * fps)
-        print(f"Looking for frame at timestamp: {timestamp}ms, relative time: {relative_time_ms}ms, target frame: {target_frame}")
-        frame_number = 0
-        cap = cv2.VideoCapture(video_path)
-        while True:
-            # Read next frame
-            success, frame = cap.read()
-            
-            # Break the loop if we've reached the end of the video
-            if not success:
-                break
-            
-            # Save the frame as an image
-            if target_frame==frame_number:
-                frame_filename = f"{timestamp}_{previous_color}.png"
-                frame_path = os.path.join(user_image_folder, frame_filename)
-                cv2.imwrite(frame_path, frame)
-                print(f"🖼️ Frame with text saved: {frame_path}")
-                # Upload this saved frame to S3 in desired folder structure
-                upload_file_to_s3(
-                    frame_path,
-                    key=f"download_data/{user_id}/images/{frame_filename}",
-                    content_type="image/png",
-                    metadata={
-                        "user_id": user_id,
-                        "timestamp": int(timestamp),
-                        "relative_time_ms": int(relative_time_ms),
-                        "color": previous_color
-                    }
-                )
-            # Increment frame number
-            frame_number += 1
-
-    cap.release()
+        target = relative_time_ms if by_time else int((relative_time_ms / 1000) * fps)
+        print(f"Looking for frame at timestamp: {timestamp}ms, relative time: {relative_time_ms}ms, target {'time' if by_time else 'frame'}: {target}")
+        targets.append((entry, relative_time_ms, target))
+
+    # Decode the video a single time for all color changes
+    if by_time:
+        frames = read_frames_at_times(video_path, [target for _, _, target in targets])
+    else:
+        frames = read_frames_at(video_path, [target for _, _, target in targets])
+
+    extracted = []
+    for entry, relative_time_ms, target in targets:
+        frame = frames.get(target)
+        if frame is None:
+            continue
+        extracted.append({
+            "timestamp": int(entry["timestamp"]),
+            "relative_time_ms": int(relative_time_ms),
+            "color": entry["new_color"],
+            "image": frame,
+        })
+    extracted.sort(key=lambda f: f["timestamp"])
+    print(f"🖼️ Extracted {len(extracted)} frames for user {user_id}")
+
+    # Written and uploaded off the verdict path; the analysis uses the frames in memory
+    submit_archive(persist_frames, user_id, extracted)
+    return extracted
+
+def persist_frames(user_id, frames):
+    """Saves extracted frames to IMAGE_FOLDER/<user> in FRAME_FORMAT and uploads them to S3."""
+    try:
+        paths = frame_store.save_frames(os.path.join(IMAGE_FOLDER, user_id), frames)
+    except Exception as e:
+        print(f"❌ Failed to save frames for user {user_id}: {e}")
+        return False
+    print(f"🖼️ {len(frames)} frames saved for user {user_id} as {frame_store.FRAME_FORMAT}")
+    # png and webp frames are one file each, in order, followed by the manifest
+    by_file = {os.path.basename(path): frame for frame, path in zip(frames, paths) if not path.endswith((".json", ".npz"))}
+    for path in paths:
+        filename = os.path.basename(path)
+        frame = by_file.get(filename)
+        # Upload each saved file to S3 in desired folder structure
+        upload_file_to_s3(
+            path,
+            key=f"download_data/{user_id}/images/{filename}",
+            content_type=frame_store.CONTENT_TYPES.get(os.path.splitext(filename)[1][1:]),
+            metadata={
+                "user_id": user_id,
+                "timestamp": frame["timestamp"],
+                "relative_time_ms": frame["relative_time_ms"],
+                "color": frame["color"]
+            } if frame else None
+        )
+    return True
 
-def is_video_injected(user_id):
+def load_analysis_frames(user_id):
+    """
+    Returns (base_frame, colored_frames, error_message) from the user's persisted frames.
+    The first frame captured under the transparent overlay is the base; every other frame is compared against it.
+    """
+    user_image_folder = os.path.join(IMAGE_FOLDER, user_id)
+    if not frame_store.has_frames(user_image_folder):
+        return None, [], "No images found for this user"
+    return select_analysis_frames(frame_store.load_frames(user_image_folder))
+
+def select_analysis_frames(frames):
+    """Splits frames into (base_frame, colored_frames, error_message) by their event color."""
+    if len(frames) < 2:
+        return None, [], "Not enough images for analysis"
+    base_frame, colored_frames = frame_store.select_base_frame(frames)
+    if base_frame is None or not colored_frames:
+        return None, [], "Could not find base frame or colored frames"
+    return base_frame, colored_frames, None
+
+def is_video_injected(user_id, render=False, timings=None, on_progress=None, frames=None):
     """
     Analyze the video frames to determine if the video is likely injected.
     Stores results in a JSON file within the analysis folder.
+    Only the numeric stats are computed unless render=True; visualizations are
+    otherwise produced on demand by render_visualizations.
+    The session's stage timings are recorded under "timings".
+    on_progress(frame, done, total) receives each color frame's details as it finishes; frame is
+    None when a frame could not be analysed and only total went down.
+    frames are the frames extract_frames just returned; without them the persisted frames are loaded.
     """
-    try:
-        # Get the user's image directory
-        user_image_folder = os.path.join(IMAGE_FOLDER, user_id)
-        if not os.path.exists(user_image_folder):
-            return {
-                "status": "error",
-                "message": "No images found for this user",
-                "is_injected": None
-            }
-
-        # Get all PNG files in the user's directory
-        images = glob.glob(os.path.join(user_image_folder, "*.png"))
-        if len(images) < 2:
-            return {
-                "status": "error",
-                "message": "Not enough images for analysis",
-                "is_injected": None
-            }
-
-        # Sort images to ensure consistent order
-        images.sort()
-        print
-        # Find transparent image as base frame
-        base_frame_path = None
-        colored_frame_paths = []
-        
-        for img_path in images:
-            if "transparent" in os.path.basename(img_path).lower():
-                if base_frame_path is None:
-                    base_frame_path = img_path
-                else:
-                    colored_frame_paths.append(img_path)
-            else:
-                colored_frame_paths.append(img_path)
+    timings = timings or current_timings() or SessionTimings()
+    with activate(timings):
+        return _is_video_injected(user_id, render, timings, on_progress, frames)
 
-        if not base_frame_path or not colored_frame_paths:
+def _is_video_injected(user_id, render, timings, on_progress=None, frames=None):
+    try:
+        if frames is None:
+            base_frame, colored_frames, error_message = load_analysis_frames(user_id)
+        else:
+            base_frame, colored_frames, error_message = select_analysis_frames(frames)
+        if error_message:
             return {
                 "status": "error",
-                "message": "Could not find base frame or colored frames",
+                "message": error_message,
                 "is_injected": None
             }
 
@@ -547,44 +1443,38 @@ def is_video_injected(user_id):
         os.makedirs(analysis_dir, exist_ok=True)
         
         # Create visualization directory if it doesn't exist
-        visualization_dir = os.path.join("data", "visualization")
-        os.makedirs(visualization_dir, exist_ok=True)
-
-        # Create temporary output directory for frame analysis
-        temp_dir = os.path.join("temp_analysis", user_id)
-        os.makedirs(temp_dir, exist_ok=True)
-
-        print("calling compare all frames:::",)
-        # Analyze frames
-        results = compare_all_frames(base_frame_path, colored_frame_paths,user_id, 
-                                   output_dir=temp_dir, threshold=20)
-        # print(" results :::",results)
-
-        if not results:
-            return {
-                "status": "error",
-                "message": "Analysis failed to produce results",
-                "is_injected": None
-            }
-
-        # Calculate key metrics
-        intensities = [r['intensity'] for r in results]
-        consistency = 100 * (1 - (max(intensities) - min(intensities)) / max(intensities))
-
-        # Check expected color matches
-        expected_matches = {
-            'Blue': 'Blue', 'Blue2': 'Blue',
-            'Red': 'Red', 
-            'Green': 'Green', 'Green2': 'Green',
-            'Yellow': 'Red',  # Yellow often appears as high in red channel
-            'Cyan': 'Green'   # Cyan often appears as high in green/blue
-        }
-        
-        matches = sum(1 for r in results if r['dominant_channel'] == expected_matches.get(r['color'], ''))
-        match_percentage = (matches / len(results)) * 100
-
-        # Determine if video is likely injected
-        is_injected = not (matches >= len(results) * 0.5 or consistency > 50)
+        if render:
+            os.makedirs(VISUALIZATION_FOLDER, exist_ok=True)
+
+        parameters = analysis_parameters(ANALYSIS_THRESHOLD, ANALYSIS_REGION)
+        key = analysis_key([base_frame, *colored_frames], parameters)
+        verdict = None if render else analysis_cache.get(key)
+        if verdict is not None:
+            print(f"♻️ Reusing cached analysis {key[:12]} for user {user_id}")
+            if on_progress:
+                details = verdict["analysis"]["frame_details"]
+                for done, detail in enumerate(details, 1):
+                    on_progress(detail, done, len(details))
+        else:
+            # Analyze frames
+            with stage("render" if render else "analyze"):
+                results = compare_frames(base_frame["image"], _compared_frames(colored_frames), user_id,
+                                         threshold=ANALYSIS_THRESHOLD, render=render, region_focus=ANALYSIS_REGION,
+                                         on_result=_progress_reporter(on_progress))
+
+            if not results:
+                return {
+                    "status": "error",
+                    "message": "Analysis failed to produce results",
+                    "is_injected": None
+                }
+
+            verdict = decide_injection(results)
+            if not render:
+                # The rendering path analyses frame pairs one by one; only batch verdicts are cached
+                analysis_cache.put(key, verdict)
+
+        is_injected = verdict["is_injected"]
         if is_injected:
             print("------------>Video is Injected")
         else:
@@ -594,29 +1484,14 @@ def is_video_injected(user_id):
             "status": "success",
             "is_injected": is_injected,
             "timestamp": datetime.datetime.now().isoformat(),
-            "analysis": {
-                "consistency": consistency,
-                "match_percentage": match_percentage,
-                "total_frames_analyzed": len(results),
-                "frames_matching_expected": matches,
-                "intensity_range": {
-                    "min": min(intensities),
-                    "max": max(intensities)
-                },
-                "frame_details": [
-                    {
-                        "color": r['color'],
-                        "intensity": r['intensity'],
-                        "dominant_channel": r['dominant_channel'],
-                        "affected_pixels": r['affected_pixels'],
-                        "channel_values": r['channel_values']
-                    } for r in results
-                ]
-            }
+            "analysis": verdict["analysis"],
+            "parameters": parameters,
+            "analysis_key": key,
+            "timings": timings.as_dict()
         }
 
         # Save analysis result to JSON file
-        output_file = os.path.join(analysis_dir, f"{user_id}_response.json")
+        output_file = _analysis_record_path(user_id)
         with open(output_file, 'w') as f:
             json.dump(analysis_result, f, indent=4)
 
@@ -624,9 +1499,6 @@ def is_video_injected(user_id):
         if s3_enabled():
             upload_file_to_s3(output_file, key=f"download_data/{user_id}/analysis/{user_id}_response.json", content_type="application/json")
 
-        # Clean up temporary directory
-        shutil.rmtree(temp_dir)
-
         return analysis_result
 
     except Exception as e:
@@ -634,11 +1506,12 @@ def is_video_injected(user_id):
             "status": "error",
             "message": str(e),
             "is_injected": None,
-            "timestamp": datetime.datetime.now().isoformat()
+            "timestamp": datetime.datetime.now().isoformat(),
+            "timings": timings.as_dict()
         }
         
         # Save error result to JSON file
-        output_file = os.path.join(analysis_dir, f"{user_id}_response.json")
+        output_file = _analysis_record_path(user_id)
         with open(output_file, 'w') as f:
             json.dump(error_result, f, indent=4)
         
@@ -648,15 +1521,185 @@ def is_video_injected(user_id):
             
         return error_result
 
-# @app.get("/analyze/{user_id}")
-def analyze_video(user_id: str):
+def _compared_frames(frames):
+    """frames as the (color_name, label, image) tuples compare_frames takes."""
+    return [(frame["color"], frame_store.frame_label(frame), frame["image"]) for frame in frames]
+
+def _progress_reporter(on_progress):
+    """Adapts compare_frames' on_result to on_progress(frame, done, total)."""
+    if on_progress is None:
+        return None
+    done = 0
+    def on_result(result, total):
+        nonlocal done
+        if result is None:
+            # A frame was skipped: only the total changes
+            on_progress(None, done, total)
+            return
+        done += 1
+        on_progress(frame_detail(result), done, total)
+    return on_result
+
+def _analysis_record_path(user_id):
+    return os.path.join("data", "analysis", f"{user_id}_response.json")
+
+_analysis_record_lock = threading.Lock()
+
+def save_session_timings(user_id, timings):
+    """Merges stages finished after the verdict (transcode, upload, render) into the analysis record."""
+    output_file = _analysis_record_path(user_id)
+    with _analysis_record_lock:
+        if not os.path.exists(output_file):
+            return
+        with open(output_file, "r") as f:
+            analysis_result = json.load(f)
+        analysis_result.setdefault("timings", {}).update(timings.as_dict())
+        with open(output_file, "w") as f:
+            json.dump(analysis_result, f, indent=4)
+    if s3_enabled():
+        upload_file_to_s3(output_file, key=f"download_data/{user_id}/analysis/{user_id}_response.json", content_type="application/json")
+
+def save_profile(user_id, profiler):
+    """Writes the sampled stacks next to the analysis record as <user>_profile.txt."""
+    output_file = os.path.join("data", "analysis", f"{user_id}_profile.txt")
+    try:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        profiler.write(output_file)
+        print(f"🔬 Profile saved for user {user_id}: {output_file} ({sum(profiler.samples.values())} samples)")
+        if s3_enabled():
+            upload_file_to_s3(output_file, key=f"download_data/{user_id}/analysis/{user_id}_profile.txt", content_type="text/plain")
+    except Exception as e:
+        print(f"⚠️ Failed to save profile for user {user_id}: {e}")
+
+def analyze_video(user_id: str, timings=None, frames=None):
     """
-    Endpoint to analyze if a video is injected based on color reflection analysis.
+    Analyzes if a video is injected based on color reflection analysis (video_end path;
+    POST /analyze/{user_id} queues the same analysis as a job).
     Results are stored in analysis/{user_id}_response.json
     """
-    result = is_video_injected(user_id)
+    result = is_video_injected(user_id, timings=timings, frames=frames)
+    if should_render_visualizations():
+        submit_render(render_visualizations, user_id, timings, frames)
+    return result
+
+def should_render_visualizations() -> bool:
+    if ANALYSIS_VISUALIZATION == "always":
+        return True
+    if ANALYSIS_VISUALIZATION == "sampled":
+        return random.random() < VISUALIZATION_SAMPLE_RATE
+    return False
+
+def render_visualizations(user_id: str, timings=None, frames=None):
+    """Renders the per-frame analysis images and summary plot for a user's extracted frames."""
+    if frames is None:
+        base_frame, colored_frames, error_message = load_analysis_frames(user_id)
+    else:
+        base_frame, colored_frames, error_message = select_analysis_frames(frames)
+    if error_message:
+        print(f"⚠️ Cannot render visualizations for user {user_id}: {error_message}")
+        return False
+    timings = timings or SessionTimings()
+    with activate(timings), stage("render"):
+        compare_frames(base_frame["image"], _compared_frames(colored_frames), user_id, threshold=ANALYSIS_THRESHOLD,
+                       render=True, region_focus=ANALYSIS_REGION)
+    save_session_timings(user_id, timings)
+    print(f"🖼️ Visualizations rendered for user {user_id}")
+    return True
+
+def run_analysis_job(job_id: str, user_id: str, loop=None):
+    """
+    Body of a POST /analyze job. Each finished color frame is recorded in the job's
+    progress and, when the user is connected over /ws and loop is given, pushed as analysis_progress.
+    """
+    job = post_processing_jobs[job_id]
+    with post_processing_lock:
+        job["progress"] = {"done": 0, "total": None, "frames": []}
+
+    def on_progress(frame, done, total):
+        with post_processing_lock:
+            frames = job["progress"]["frames"] + ([frame] if frame is not None else [])
+            job["progress"] = {"done": done, "total": total, "frames": frames}
+        _save_job(job)
+        if loop is not None and user_id in manager.active_connections:
+            message = {"event": "analysis_progress", "data": {"job_id": job_id, "frame": frame, "done": done, "total": total}}
+            asyncio.run_coroutine_threadsafe(manager.send_personal_message(message, user_id), loop)
+
+    timings = SessionTimings()
+    result = is_video_injected(user_id, timings=timings, on_progress=on_progress)
+    if result.get("status") != "success":
+        with post_processing_lock:
+            job["error"] = result.get("message")
+        return False
     return result
 
+@app.post("/analyze/{user_id}", status_code=202)
+async def request_analysis(user_id: str, push: bool = True, api_key: str = Depends(verify_api_key)):
+    """
+    Queues an analysis of a user's extracted frames and returns its job id at once.
+    Poll GET /analyze/jobs/{job_id} for progress and the result; with push=true a
+    connected client also receives analysis_progress and analysis_complete events.
+    """
+    if not frame_store.has_frames(os.path.join(IMAGE_FOLDER, user_id)):
+        raise HTTPException(status_code=404, detail="No images found for this user")
+    loop = asyncio.get_running_loop() if push else None
+    job_id = str(uuid4())
+    job_id, future = await run_store_io(lambda: submit_post_processing(user_id, run_analysis_job, job_id, user_id, loop,
+                                                                        kind="analysis", job_id=job_id))
+    if job_id is None:
+        raise HTTPException(status_code=503, detail="Server busy, please retry")
+    if push:
+        task = asyncio.create_task(notify_analysis_result(job_id, future, user_id))
+        notification_tasks.add(task)
+        task.add_done_callback(notification_tasks.discard)
+    return {"status": "queued", "job_id": job_id, "user_id": user_id, "status_url": f"/analyze/jobs/{job_id}"}
+
+async def notify_analysis_result(job_id: str, future, user_id: str):
+    """Pushes analysis_complete to the user's /ws connection, if any, once the job finishes."""
+    try:
+        await asyncio.wrap_future(future)
+    except Exception as e:
+        print(f"❌ Analysis job {job_id} failed for user {user_id}: {e}")
+    job = post_processing_jobs.get(job_id, {})
+    result = job.get("result") or {}
+    message = {"event": "analysis_complete", "data": {
+        "job_id": job_id,
+        "status": job.get("status"),
+        "is_injected": result.get("is_injected"),
+    }}
+    try:
+        await manager.send_personal_message(message, user_id)
+    except Exception as e:
+        print(f"⚠️ Could not deliver analysis_complete to user {user_id}: {e}")
+
+@app.get("/analyze/jobs/{job_id}")
+async def get_analysis_job(job_id: str, api_key: str = Depends(verify_api_key)):
+    """Status, per-frame progress and, once done, the result of a post-processing job."""
+    with post_processing_lock:
+        job = post_processing_jobs.get(job_id)
+        job = dict(job) if job is not None else None
+    if job is None:
+        # Queued on another worker
+        job = await run_store_io(session_store.load_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/visualize/{user_id}", status_code=202)
+async def request_visualizations(user_id: str, api_key: str = Depends(verify_api_key)):
+    """Queues rendering of the analysis visualizations for a user."""
+    if not frame_store.has_frames(os.path.join(IMAGE_FOLDER, user_id)):
+        raise HTTPException(status_code=404, detail="No images found for this user")
+    submit_render(render_visualizations, user_id)
+    return {"status": "queued", "user_id": user_id}
+
+@app.get("/visualize/{user_id}")
+async def get_visualization_summary(user_id: str, api_key: str = Depends(verify_api_key)):
+    """Returns the rendered summary plot once it exists."""
+    summary_path = os.path.join(VISUALIZATION_FOLDER, f"{user_id}_analysis", "summary_analysis.png")
+    if not os.path.exists(summary_path):
+        raise HTTPException(status_code=404, detail="Visualization not rendered yet")
+    return FileResponse(summary_path, media_type="image/png")
+
 if __name__ == "__main__":
     print("🚀 Starting FastAPI with HTTPS and WebSockets on port 8000...")
     
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Pipeline Benchmark Suite
+Generates synthetic verification sessions (WebM/MP4 clips with a face-like patch
+and timed color flashes, plus matching color_data) and times each backend stage
+and the whole video_end pipeline. Results are written as JSON so runs from
+different commits can be compared.
+
+Runs offline: needs ffmpeg on PATH, S3 is always disabled.
+
+    python benchmark.py --resolutions 640x480 1280x720 --durations 8 --repeat 3 --output bench.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Same sequence the frontend flashes (see face-verification-ui/src/common/constants.ts)
+SCAN_COLORS = [
+    "#00000000", "#000000", "#0000FF", "#FFFF00", "#00FF00", "#00000000",
+    "#FF0000", "#0000FF", "#00FFFF", "#00FF00", "#00000000",
+]
+DURATION_PER_COLOR_MS = 700
+VIDEO_START_TIME = 1_700_000_000_000
+
+
+def _hex_to_bgr(hex_color):
+    hex_color = hex_color.lstrip("#")
+    if len(hex_color) == 8:
+        # "#00000000" is the transparent overlay: no tint
+        return None
+    r, g, b = (int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+    return (b, g, r)
+
+
+def flash_schedule(duration_s, fps):
+    """Returns [(start_ms, hex_color)] spreading SCAN_COLORS after a 1 s lead-in."""
+    schedule = []
+    start_ms = 1000
+    for color in SCAN_COLORS:
+        if start_ms >= duration_s * 1000 - DURATION_PER_COLOR_MS:
+            break
+        schedule.append((start_ms, color))
+        start_ms += DURATION_PER_COLOR_MS
+    return schedule
+
+
+def render_frame(width, height, t_ms, schedule, rng):
+    """Background + skin-toned face patch, lit by whichever color is flashing at t_ms."""
+    frame = np.full((height, width, 3), (70, 80, 90), dtype=np.uint8)
+    center = (width // 2 + int(4 * np.sin(t_ms / 300)), height // 2)
+    axes = (width // 7, height // 4)
+    cv2.ellipse(frame, center, axes, 0, 0, 360, (140, 170, 215), -1)
+    eye_dy, eye_dx = axes[1] // 4, axes[0] // 2
+    for dx in (-eye_dx, eye_dx):
+        cv2.circle(frame, (center[0] + dx, center[1] - eye_dy), max(2, axes[0] // 8), (40, 40, 40), -1)
+    cv2.ellipse(frame, (center[0], center[1] + axes[1] // 2), (axes[0] // 3, axes[1] // 10), 0, 0, 180, (60, 60, 150), 2)
+
+    active = None
+    for start_ms, color in schedule:
+        if start_ms <= t_ms:
+            active = color
+    tint = _hex_to_bgr(active) if active else None
+    if tint is not None:
+        face_mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.ellipse(face_mask, center, axes, 0, 0, 360, 255, -1)
+        tinted = cv2.addWeighted(frame, 0.75, np.full_like(frame, tint), 0.25, 0)
+        frame[face_mask > 0] = tinted[face_mask > 0]
+
+    noise = rng.integers(-3, 4, size=frame.shape, dtype=np.int16)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def generate_session(out_dir, user_id, width, height, duration_s, fps=30, seed=0):
+    """
+    Writes <user>_recording.webm, <user>.mp4 and <user>.json (color_data) into out_dir.
+    Returns the paths and the color events.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    webm_path = os.path.join(out_dir, f"{user_id}_recording.webm")
+    mp4_path = os.path.join(out_dir, f"{user_id}.mp4")
+    color_path = os.path.join(out_dir, f"{user_id}.json")
+
+    schedule = flash_schedule(duration_s, fps)
+    rng = np.random.default_rng(seed)
+
+    # Live-style WebM like MediaRecorder produces (no duration / frame count in the header)
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "pipe:0",
+        "-c:v", "libvpx", "-b:v", "2500k", "-deadline", "realtime", "-cpu-used", "8",
+        "-live", "1", "-f", "webm", webm_path,
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    for i in range(int(duration_s * fps)):
+        process.stdin.write(render_frame(width, height, i * 1000 / fps, schedule, rng).tobytes())
+    process.stdin.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to write {webm_path}")
+
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", webm_path, "-c:v", "libx264",
+                    "-preset", "fast", "-crf", "23", mp4_path], check=True)
+
+    color_events = []
+    previous = "#000000"
+    for start_ms, color in schedule:
+        # Events are sent mid-flash, once the scan line reaches the bottom
+        color_events.append({
+            "previousColor": previous,
+            "newColor": color,
+            "timestamp": VIDEO_START_TIME + start_ms + DURATION_PER_COLOR_MS // 2,
+            "video_start_time": VIDEO_START_TIME,
+        })
+        previous = color
+    with open(color_path, "w") as f:
+        json.dump(color_events, f, indent=4)
+
+    return {"webm": webm_path, "mp4": mp4_path, "color_data": color_path, "events": color_events}
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _load_app(workdir):
+    """Imports app.py with S3 and the analysis cache disabled and data/ rooted in workdir."""
+    os.environ.pop("S3_BUCKET_NAME", None)
+    os.environ.setdefault("API_KEY", "benchmark")
+    os.environ["ANALYSIS_VISUALIZATION"] = "never"
+    # Every --repeat run analyses the same frames; with the cache on, runs 2+ would time lookups
+    os.environ["ANALYSIS_CACHE"] = "false"
+    os.environ["ARCHIVE_WORKERS"] = "1"
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import app
+    return app
+
+
+def replay_session(app, session, user_id, chunk_count=8):
+    """Feeds a generated session through the websocket handlers, without a socket."""
+    app.handle_video_start({"timestamp": VIDEO_START_TIME})
+    for event in session["events"]:
+        app.handle_color_change(event, user_id)
+    with open(session["webm"], "rb") as f:
+        data = f.read()
+    step = len(data) // chunk_count + 1
+    for i in range(chunk_count):
+        chunk = data[i * step:(i + 1) * step]
+        if chunk:
+            app.handle_video_chunk({"mimeType": "video/webm;codecs=vp8", "sequence": i}, chunk, user_id)
+
+
+def benchmark_session(app, session, user_id):
+    """Times each stage once for a generated session; returns {stage: seconds}."""
+    timings = {}
+    color_data = [
+        {
+            "previous_color": app.COLOR_MAP.get(e["previousColor"], e["previousColor"]),
+            "new_color": app.COLOR_MAP.get(e["newColor"], e["newColor"]),
+            "timestamp": e["timestamp"],
+            "video_start_time": e["video_start_time"],
+        }
+        for e in session["events"]
+    ]
+
+    converted = os.path.join(app.MP4_FOLDER, f"{user_id}_converted.mp4")
+    timings["convert_webm_to_mp4"], _ = _timed(app.convert_webm_to_mp4, session["webm"], converted)
+
+    timings["extract_frames_webm"], _ = _timed(app.extract_frames, user_id, session["webm"], color_data, by_time=True)
+    # Frames are saved on the archive pool; wait for them before clearing the folder
+    timings["persist_frames"], _ = _timed(lambda: app.archive_executor.submit(lambda: None).result())
+    shutil.rmtree(os.path.join(app.IMAGE_FOLDER, user_id), ignore_errors=True)
+    final_mp4 = os.path.join(app.MP4_FOLDER, f"{user_id}_final_video.mp4")
+    shutil.copyfile(session["mp4"], final_mp4)
+    timings["extract_frames_mp4"], frames = _timed(app.extract_frames, user_id, final_mp4, color_data, by_time=False)
+    app.archive_executor.submit(lambda: None).result()
+
+    base_frame, colored_frames, error_message = app.select_analysis_frames(frames)
+    if error_message:
+        print(f"⚠️ Skipping analysis stages for {user_id}: {error_message}")
+    else:
+        compared = app._compared_frames(colored_frames)
+        timings["load_frames"], _ = _timed(app.load_analysis_frames, user_id)
+        timings["compare_frames"], _ = _timed(
+            app.compare_frames, base_frame["image"], compared, user_id, threshold=20, render=False)
+        timings["compare_frames_render"], _ = _timed(
+            app.compare_frames, base_frame["image"], compared, user_id, threshold=20, render=True)
+        timings["is_video_injected"], _ = _timed(app.is_video_injected, user_id)
+
+    # Whole pipeline: ingest through verdict, then wait for the background archive
+    pipeline_user = f"{user_id}-pipeline"
+    timings["ingest"], _ = _timed(replay_session, app, session, pipeline_user)
+    timings["handle_video_end"], _ = _timed(app.handle_video_end, {}, pipeline_user)
+    timings["archive"], _ = _timed(lambda: app.archive_executor.submit(lambda: None).result())
+    timings["pipeline_total"] = timings["ingest"] + timings["handle_video_end"] + timings["archive"]
+    return timings
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the verification pipeline on synthetic sessions")
+    parser.add_argument("--resolutions", nargs="+", default=["640x480", "1280x720", "1920x1080"])
+    parser.add_argument("--durations", nargs="+", type=float, default=[8.0])
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration; the median is reported")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--workdir", default=None, help="where sessions and data/ are written (default: temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        print("❌ ffmpeg not found on PATH")
+        sys.exit(1)
+
+    output_path = os.path.abspath(args.output)
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="kyc-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    app = _load_app(workdir)
+
+    results = []
+    try:
+        for resolution in args.resolutions:
+            width, height = (int(v) for v in resolution.lower().split("x"))
+            for duration in args.durations:
+                label = f"{width}x{height}_{duration:g}s"
+                print(f"\n🔄 Generating session {label}")
+                session = generate_session(os.path.join(workdir, "sessions"), label, width, height, duration, fps=args.fps)
+
+                runs = []
+                for run in range(args.repeat):
+                    runs.append(benchmark_session(app, session, f"{label}-run{run}"))
+                    print(f"   run {run + 1}/{args.repeat}: pipeline {runs[-1]['pipeline_total']:.3f}s")
+
+                for stage in runs[0]:
+                    samples = [r[stage] for r in runs if stage in r]
+                    results.append({
+                        "resolution": resolution,
+                        "duration_s": duration,
+                        "fps": args.fps,
+                        "color_events": len(session["events"]),
+                        "stage": stage,
+                        "median_s": statistics.median(samples),
+                        "min_s": min(samples),
+                        "max_s": max(samples),
+                        "runs": samples,
+                    })
+    finally:
+        if not args.keep and not args.workdir:
+            os.chdir(REPO_DIR)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": _git_commit(),
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "cpu_count": os.cpu_count(),
+            "opencv": cv2.__version__,
+        },
+        "results": results,
+    }
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n📊 {'stage':<28}{'resolution':<12}{'duration':>9}{'median (s)':>12}")
+    for row in results:
+        print(f"   {row['stage']:<28}{row['resolution']:<12}{row['duration_s']:>8g}s{row['median_s']:>12.3f}")
+    print(f"\n✅ Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+// Binary framing for video chunks, see protocol.py on the backend.
+// One WebSocket message per chunk: 28-byte big-endian header, MIME type, chunk bytes.
+export const CHUNK_FRAME_VERSION = 1;
+
+const MAGIC = [0x4b, 0x56]; // "KV"
+const EVENT_VIDEO_CHUNK = 1;
+const FLAG_FINAL = 0x01;
+const HEADER_SIZE = 28;
+
+export interface ChunkFrameMeta {
+    sequence: number;
+    startTime?: number;
+    endTime?: number;
+    mimeType?: string;
+    fromEnd?: boolean;
+}
+
+export const encodeChunkFrame = (meta: ChunkFrameMeta, payload: Uint8Array): Uint8Array => {
+    const mime = new TextEncoder().encode(meta.mimeType || "");
+    const frame = new Uint8Array(HEADER_SIZE + mime.length + payload.length);
+    const view = new DataView(frame.buffer);
+
+    frame.set(MAGIC, 0);
+    view.setUint8(2, CHUNK_FRAME_VERSION);
+    view.setUint8(3, EVENT_VIDEO_CHUNK);
+    view.setUint8(4, meta.fromEnd ? FLAG_FINAL : 0);
+    view.setUint16(6, mime.length);
+    view.setUint32(8, meta.sequence);
+    view.setBigInt64(12, BigInt(Math.trunc(meta.startTime || 0)));
+    view.setBigInt64(20, BigInt(Math.trunc(meta.endTime || 0)));
+    frame.set(mime, HEADER_SIZE);
+    frame.set(payload, HEADER_SIZE + mime.length);
+    return frame;
+};
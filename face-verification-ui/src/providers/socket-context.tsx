@@ -1,5 +1,6 @@
-import { createContext, useEffect, useState } from "react";
+import { createContext, useEffect, useRef, useState } from "react";
 import { BACKEND_URL, API_KEY } from "../config/config";
+import { CHUNK_FRAME_VERSION, encodeChunkFrame } from "../common/chunk-frame";
 
 export interface SocketContextType {
     socket: WebSocket | null;
@@ -13,68 +14,242 @@ export const SocketContext = createContext<SocketContextType>({
     sendBinaryMessage: () => {},
 });
 
+const MAX_RECONNECT_DELAY_MS = 8000;
+// Gap between chunk sends while the server asks us to throttle; every chunk sent
+// gets an ack with a fresh throttle flag, so pacing stops once the server catches up
+const THROTTLE_SEND_INTERVAL_MS = 250;
+
+interface PendingChunk {
+    data: any;
+    binaryData: Uint8Array;
+}
+
 const SocketContextProvider = (props: any): JSX.Element => {
     const [socket, setSocket] = useState<WebSocket | null>(null);
-    const [userId, setUserId] = useState<string | null>(null);
+    const socketRef = useRef<WebSocket | null>(null);
+    const userIdRef = useRef<string | null>(null);
+    // Chunk framing versions the server advertised in the user_id message
+    const framingVersionsRef = useRef<number[]>([]);
+    // Lets a dropped connection reattach to the same session
+    const resumeTokenRef = useRef<string | null>(null);
+    // Chunks the server has not written to disk yet, by sequence; re-sent after a resume
+    const unackedChunksRef = useRef<Map<number, PendingChunk>>(new Map());
+    // Set from chunk_ack while the server's writer is behind
+    const throttledRef = useRef(false);
+    // Chunks held back while throttled, in recording order, and text messages sent after them
+    const throttledChunksRef = useRef<(PendingChunk | string)[]>([]);
+    const throttleTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
+    // Text messages sent while reconnecting
+    const outboxRef = useRef<string[]>([]);
+    const reconnectAttemptRef = useRef(0);
 
-    useEffect(() => {
-        if (!socket?.OPEN) {
-            // Use ws/wss based on current page protocol
-            const wsUrl = BACKEND_URL.replace(/^http/, 'ws') + '/ws?api_key=' + encodeURIComponent(API_KEY);
-    
-            console.log("Attempting to connect to WebSocket URL:", wsUrl);
-    
-            const socketConnection = new WebSocket(wsUrl);
-            
-            socketConnection.onopen = () => {
-                console.log("WebSocket connection established");
-            };
-    
-            socketConnection.onmessage = (event) => {
-                try {
-                    const message = JSON.parse(event.data);
-                    if (message.event === "user_id") {
-                        setUserId(message.data.user_id);
+    const connect = () => {
+        // Use ws/wss based on current page protocol
+        let wsUrl = BACKEND_URL.replace(/^http/, 'ws') + '/ws?api_key=' + encodeURIComponent(API_KEY);
+        if (resumeTokenRef.current) {
+            wsUrl += '&resume_token=' + encodeURIComponent(resumeTokenRef.current);
+        }
+
+        console.log("Attempting to connect to WebSocket URL:", wsUrl);
+
+        const socketConnection = new WebSocket(wsUrl);
+
+        socketConnection.onopen = () => {
+            console.log("WebSocket connection established");
+            reconnectAttemptRef.current = 0;
+        };
+
+        socketConnection.onmessage = (event) => {
+            try {
+                const message = JSON.parse(event.data);
+                if (message.event === "user_id") {
+                    if (userIdRef.current && userIdRef.current !== message.data.user_id) {
+                        // Session could not be resumed: the old recording is gone
+                        unackedChunksRef.current.clear();
+                    }
+                    // Held-back chunks are in unackedChunks and are re-sent with them after a resume;
+                    // held-back text messages move to the outbox
+                    resetThrottle();
+                    userIdRef.current = message.data.user_id;
+                    resumeTokenRef.current = message.data.resume_token ?? null;
+                    framingVersionsRef.current = message.data.chunk_framing?.versions ?? [];
+                    if (!message.data.resume_token || !unackedChunksRef.current.size) {
+                        flushOutbox(socketConnection);
+                    }
+                } else if (message.event === "session_resumed") {
+                    console.log("Session resumed after chunk", message.data.last_sequence);
+                    resendChunks(socketConnection, message.data.last_sequence);
+                    flushOutbox(socketConnection);
+                } else if (message.event === "chunk_ack") {
+                    for (const sequence of unackedChunksRef.current.keys()) {
+                        if (sequence <= message.data.persisted_sequence) {
+                            unackedChunksRef.current.delete(sequence);
+                        }
                     }
-                } catch (error) {
-                    console.error("Error parsing WebSocket message:", error);
+                    throttledRef.current = Boolean(message.data.throttle);
+                    if (!throttledRef.current) {
+                        sendThrottledChunks(throttledChunksRef.current.length);
+                    }
+                } else if (message.event === "chunk_rejected") {
+                    // Resending would be rejected again
+                    console.warn("Server rejected chunk", message.data.sequence, message.data.message);
+                    unackedChunksRef.current.delete(message.data.sequence);
                 }
-            };
-    
-            socketConnection.onerror = (error) => {
-                console.error("WebSocket error:", error);
-            };
-    
-            socketConnection.onclose = () => {
-                console.log("WebSocket connection closed");
-            };
-    
-            setSocket(socketConnection);
+            } catch (error) {
+                console.error("Error parsing WebSocket message:", error);
+            }
+        };
+
+        socketConnection.onerror = (error) => {
+            console.error("WebSocket error:", error);
+        };
+
+        socketConnection.onclose = (event) => {
+            console.log("WebSocket connection closed");
+            if (socketRef.current !== socketConnection || event.code === 4001) {
+                return;
+            }
+            // Reconnect with the resume token, backing off on repeated failures
+            const delay = Math.min(500 * 2 ** reconnectAttemptRef.current, MAX_RECONNECT_DELAY_MS);
+            reconnectAttemptRef.current += 1;
+            setTimeout(connect, delay);
+        };
+
+        socketRef.current = socketConnection;
+        setSocket(socketConnection);
+    };
+
+    const flushOutbox = (target: WebSocket) => {
+        const queued = outboxRef.current;
+        outboxRef.current = [];
+        queued.forEach(message => target.send(message));
+    };
+
+    const resetThrottle = () => {
+        throttledRef.current = false;
+        throttledChunksRef.current.forEach(item => {
+            if (typeof item === "string") {
+                outboxRef.current.push(item);
+            }
+        });
+        throttledChunksRef.current = [];
+        if (throttleTimerRef.current) {
+            clearTimeout(throttleTimerRef.current);
+            throttleTimerRef.current = null;
+        }
+    };
+
+    const sendThrottledChunks = (count: number) => {
+        const current = socketRef.current;
+        if (current?.readyState !== WebSocket.OPEN) {
+            return;
         }
+        // Text messages go out as soon as the chunks queued before them are sent
+        while (throttledChunksRef.current.length) {
+            const item = throttledChunksRef.current[0];
+            if (typeof item === "string") {
+                current.send(item);
+            } else if (count > 0) {
+                sendChunk(current, item.data, item.binaryData);
+                count -= 1;
+            } else {
+                break;
+            }
+            throttledChunksRef.current.shift();
+        }
+        scheduleThrottledChunk();
+    };
+
+    const scheduleThrottledChunk = () => {
+        if (throttleTimerRef.current || !throttledChunksRef.current.length) {
+            return;
+        }
+        throttleTimerRef.current = setTimeout(() => {
+            throttleTimerRef.current = null;
+            sendThrottledChunks(1);
+        }, THROTTLE_SEND_INTERVAL_MS);
+    };
+
+    const resendChunks = (target: WebSocket, lastSequence: number) => {
+        const sequences = [...unackedChunksRef.current.keys()].sort((a, b) => a - b);
+        for (const sequence of sequences) {
+            if (sequence <= lastSequence) {
+                unackedChunksRef.current.delete(sequence);
+                continue;
+            }
+            const { data, binaryData } = unackedChunksRef.current.get(sequence)!;
+            sendChunk(target, data, binaryData);
+        }
+    };
+
+    useEffect(() => {
+        if (!socketRef.current) {
+            connect();
+        }
+        return () => {
+            const current = socketRef.current;
+            socketRef.current = null;
+            resetThrottle();
+            current?.close();
+        };
     }, []);
-    
+
+    const encodeMessage = (event: string, data: any) => JSON.stringify({
+        event,
+        data: {
+            ...data,
+            user_id: userIdRef.current
+        }
+    });
 
     const sendMessage = (event: string, data: any) => {
-        if (socket?.readyState === WebSocket.OPEN) {
-            const message = {
-                event,
-                data: {
-                    ...data,
-                    user_id: userId
-                }
-            };
-            socket.send(JSON.stringify(message));
+        const current = socketRef.current;
+        if (throttledChunksRef.current.length) {
+            // e.g. video_end must not overtake the chunks held back by throttling
+            throttledChunksRef.current.push(encodeMessage(event, data));
+        } else if (current?.readyState === WebSocket.OPEN) {
+            current.send(encodeMessage(event, data));
+        } else {
+            outboxRef.current.push(encodeMessage(event, data));
+        }
+    };
+
+    const sendChunk = (target: WebSocket, data: any, binaryData: Uint8Array) => {
+        if (framingVersionsRef.current.includes(CHUNK_FRAME_VERSION)) {
+            // Metadata and bytes in a single binary message
+            target.send(encodeChunkFrame(data, binaryData));
+            return;
         }
+
+        // Older servers: first send the metadata
+        target.send(encodeMessage("video_chunk", data));
+
+        // Then send the binary data
+        target.send(binaryData);
     };
 
     const sendBinaryMessage = (event: string, data: any, binaryData: Uint8Array) => {
-        if (socket?.readyState === WebSocket.OPEN) {
-            // First send the metadata
-            sendMessage(event, data);
-            
-            // Then send the binary data
-            socket.send(binaryData);
+        const current = socketRef.current;
+        if (event === "video_chunk" && typeof data.sequence === "number") {
+            // Kept until the server acknowledges it on disk
+            unackedChunksRef.current.set(data.sequence, { data, binaryData });
+        }
+        if (current?.readyState !== WebSocket.OPEN) {
+            // Re-sent from unackedChunks once the session is resumed
+            return;
+        }
+        if (event === "video_chunk") {
+            if (throttledRef.current || throttledChunksRef.current.length) {
+                // Keeps chunk order: sent one at a time until the server stops throttling
+                throttledChunksRef.current.push({ data, binaryData });
+                scheduleThrottledChunk();
+                return;
+            }
+            sendChunk(current, data, binaryData);
+            return;
         }
+        current.send(encodeMessage(event, data));
+        current.send(binaryData);
     };
 
     return (
@@ -0,0 +1,139 @@
+"""
+Extracted frames.
+extract_frames hands frames to the analysis in memory, as dicts:
+
+    {"timestamp": ms, "relative_time_ms": ms, "color": "blue", "image": BGR ndarray}
+
+where color is the overlay shown when the frame was captured (the color event's
+new_color). They are persisted to data/images/<user>/ in the background, in
+FRAME_FORMAT:
+
+    png    <timestamp>_<color>.png, low compression (FRAME_PNG_COMPRESSION, 0-9)
+    webp   <timestamp>_<color>.webp, lossless
+    npz    a single frames.npz bundle holding every frame and its metadata
+
+png and webp folders get a frames.json manifest with the event metadata.
+Folders without one (older sessions, download_data from S3) fall back to the
+<timestamp>_<color> file names.
+"""
+
+import glob
+import json
+import os
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+FRAME_FORMAT = os.getenv("FRAME_FORMAT", "png").lower()
+FRAME_PNG_COMPRESSION = int(os.getenv("FRAME_PNG_COMPRESSION", "1"))
+
+FORMATS = ("png", "webp", "npz")
+MANIFEST = "frames.json"
+BUNDLE = "frames.npz"
+CONTENT_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "npz": "application/octet-stream",
+    "json": "application/json",
+}
+# Color of the frames every other frame is compared against
+BASE_COLOR = "transparent"
+
+
+def frame_filename(frame: dict, fmt: str) -> str:
+    return f"{frame['timestamp']}_{frame['color']}.{fmt}"
+
+
+def save_frames(folder: str, frames: List[dict], fmt: Optional[str] = None) -> List[str]:
+    """Writes the frames and their metadata to folder; returns the paths written."""
+    fmt = (fmt or FRAME_FORMAT).lower()
+    if fmt not in FORMATS:
+        print(f"⚠️ Unknown FRAME_FORMAT {fmt!r}, saving frames as png")
+        fmt = "png"
+    os.makedirs(folder, exist_ok=True)
+    metadata = [{k: v for k, v in frame.items() if k != "image"} for frame in frames]
+
+    if fmt == "npz":
+        path = os.path.join(folder, BUNDLE)
+        arrays = {f"frame_{i}": frame["image"] for i, frame in enumerate(frames)}
+        temp_path = f"{path}.tmp.npz"
+        # Uncompressed: the frames are written and read back as raw arrays
+        np.savez(temp_path, metadata=np.array(json.dumps(metadata)), **arrays)
+        os.replace(temp_path, path)
+        return [path]
+
+    params = [cv2.IMWRITE_PNG_COMPRESSION, FRAME_PNG_COMPRESSION] if fmt == "png" else [cv2.IMWRITE_WEBP_QUALITY, 101]
+    paths = []
+    for frame, entry in zip(frames, metadata):
+        entry["file"] = frame_filename(frame, fmt)
+        path = os.path.join(folder, entry["file"])
+        cv2.imwrite(path, frame["image"], params)
+        paths.append(path)
+    manifest_path = os.path.join(folder, MANIFEST)
+    with open(manifest_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    paths.append(manifest_path)
+    return paths
+
+
+def _parse_filename(path: str) -> dict:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    timestamp, _, color = stem.rpartition("_")
+    try:
+        timestamp = int(timestamp)
+    except ValueError:
+        pass
+    return {"timestamp": timestamp, "color": color, "file": os.path.basename(path)}
+
+
+def load_frames(folder: str) -> List[dict]:
+    """Reads the frames saved in folder, in capture order; frames that fail to decode are skipped."""
+    bundle = os.path.join(folder, BUNDLE)
+    if os.path.exists(bundle):
+        with np.load(bundle) as data:
+            metadata = json.loads(str(data["metadata"]))
+            return [dict(entry, image=data[f"frame_{i}"]) for i, entry in enumerate(metadata)]
+
+    manifest = os.path.join(folder, MANIFEST)
+    if os.path.exists(manifest):
+        with open(manifest, "r") as f:
+            metadata = json.load(f)
+    else:
+        paths = glob.glob(os.path.join(folder, "*.png")) + glob.glob(os.path.join(folder, "*.webp"))
+        metadata = [_parse_filename(path) for path in sorted(paths)]
+
+    frames = []
+    for entry in metadata:
+        image = cv2.imread(os.path.join(folder, entry["file"]))
+        if image is None:
+            print(f"Error: Could not load frame {entry['file']} from {folder}")
+            continue
+        frames.append(dict(entry, image=image))
+    return frames
+
+
+def has_frames(folder: str) -> bool:
+    return os.path.exists(os.path.join(folder, BUNDLE)) or bool(
+        glob.glob(os.path.join(folder, "*.png")) or glob.glob(os.path.join(folder, "*.webp")))
+
+
+def select_base_frame(frames: List[dict]) -> Tuple[Optional[dict], List[dict]]:
+    """
+    Splits frames into (base, colored) by their event color: the first frame captured
+    under the transparent overlay is the base, every other frame is compared against it.
+    """
+    base = None
+    colored = []
+    for frame in frames:
+        if base is None and frame["color"] == BASE_COLOR:
+            base = frame
+        else:
+            colored.append(frame)
+    return base, colored
+
+
+def frame_label(frame: dict) -> str:
+    """Identifies a frame in analysis results: its file name, or <timestamp>_<color> for frames without one."""
+    return frame.get("file") or f"{frame['timestamp']}_{frame['color']}"
+
@@ -0,0 +1,169 @@
+"""
+Per-session chunk ingest.
+ChunkWriter puts a recording's video chunks back in sequence order and appends
+them to the aggregate file from a worker pool, coalescing everything that
+arrived since the previous write into one write. submit() never touches the
+disk, so the event loop only copies references; buffered_bytes tells the
+websocket handler when to ask the client to slow down.
+A writer can also continue a file another worker started: pass the byte offset
+and next sequence number that worker persisted.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class ChunkWriter:
+    def __init__(self, path: str, executor, transcoder=None, max_reorder: int = 8, first_sequence: int = 0,
+                 offset: int = 0, on_write: Optional[Callable[["ChunkWriter"], None]] = None):
+        self.path = path
+        self.executor = executor
+        self.transcoder = transcoder
+        self.max_reorder = max_reorder
+        self.offset = offset
+        # Called from the writer thread after every write, e.g. to publish progress
+        self.on_write = on_write
+
+        self.next_sequence = first_sequence
+        self.persisted_sequence = first_sequence - 1
+        self.buffered_bytes = 0
+        self.bytes_written = offset
+        self.write_seconds = 0.0
+        self.dropped_chunks = 0
+        self.error: Optional[Exception] = None
+        self.closed = False
+
+        self._pending: Dict[int, bytes] = {}
+        self._ready: List[Tuple[int, bytes]] = []
+        self._draining = False
+        self._file = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def submit(self, sequence: Optional[int], chunk: bytes) -> bool:
+        """
+        Buffers a chunk; returns False for duplicates and chunks after close().
+        Chunks without a sequence number are appended in arrival order.
+        """
+        with self._lock:
+            if self.closed:
+                return False
+            if sequence is None:
+                sequence = max([self.next_sequence - 1, *self._pending]) + 1
+            if sequence < self.next_sequence or sequence in self._pending:
+                self.dropped_chunks += 1
+                return False
+
+            self._pending[sequence] = chunk
+            self.buffered_bytes += len(chunk)
+            self._promote()
+            if len(self._pending) > self.max_reorder:
+                # Waited long enough for the missing chunk: skip the gap
+                missing = self.next_sequence
+                self.next_sequence = min(self._pending)
+                print(f"⚠️ Chunks {missing}..{self.next_sequence - 1} never arrived for {self.path}, skipping")
+                self._promote()
+            self._schedule()
+            return True
+
+    def _promote(self):
+        while self.next_sequence in self._pending:
+            self._ready.append((self.next_sequence, self._pending.pop(self.next_sequence)))
+            self.next_sequence += 1
+
+    def _schedule(self):
+        if self._ready and not self._draining:
+            self._draining = True
+            self.executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._ready:
+                    self._draining = False
+                    if self.closed:
+                        # close()/abort() gave up waiting and left the file to us
+                        self._close_file()
+                    self._idle.notify_all()
+                    return
+                batch, self._ready = self._ready, []
+
+            data = b"".join(chunk for _, chunk in batch)
+            started = time.perf_counter()
+            try:
+                if self.error is None:
+                    if self._file is None:
+                        self._file = self._open()
+                    self._file.write(data)
+                    self._file.flush()
+                    if self.transcoder:
+                        self.transcoder.feed(data)
+            except OSError as e:
+                print(f"❌ Failed to write chunks to {self.path}: {e}")
+                self.error = e
+
+            with self._lock:
+                self.buffered_bytes -= len(data)
+                self.bytes_written += len(data)
+                self.persisted_sequence = batch[-1][0]
+                self.write_seconds += time.perf_counter() - started
+            if self.on_write and self.error is None:
+                try:
+                    self.on_write(self)
+                except Exception as e:
+                    print(f"⚠️ Chunk writer callback failed for {self.path}: {e}")
+
+    def _open(self):
+        if not self.offset:
+            return open(self.path, "wb")
+        # Drop anything written past the last persisted chunk before appending
+        f = open(self.path, "r+b")
+        f.truncate(self.offset)
+        f.seek(self.offset)
+        return f
+
+    def _close_file(self):
+        # Called with the lock held once no drain is running
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _wait_idle(self, timeout: Optional[float]) -> bool:
+        return self._idle.wait_for(lambda: not self._draining and not self._ready, timeout)
+
+    def flush(self, timeout: Optional[float] = 10.0) -> bool:
+        """Waits until every in-order chunk received so far is on disk; the writer stays open."""
+        with self._lock:
+            return self._wait_idle(timeout)
+
+    def close(self, timeout: Optional[float] = 60.0) -> bool:
+        """
+        Writes out everything received, including chunks still waiting for a
+        gap to fill, and closes the file. Returns False if the data is incomplete;
+        after a timeout the drain still running closes the file when it finishes.
+        """
+        with self._lock:
+            self.closed = True
+            if self._pending:
+                print(f"⚠️ Closing {self.path} with {len(self._pending)} chunk(s) out of order, gaps skipped")
+                for sequence in sorted(self._pending):
+                    self._ready.append((sequence, self._pending.pop(sequence)))
+            self._schedule()
+            drained = self._wait_idle(timeout)
+            if not self._draining:
+                self._close_file()
+        return drained and self.error is None
+
+    def abort(self):
+        """Drops buffered chunks and closes the file without waiting for the gaps."""
+        with self._lock:
+            self.closed = True
+            self.buffered_bytes -= sum(len(chunk) for chunk in self._pending.values())
+            self.buffered_bytes -= sum(len(chunk) for _, chunk in self._ready)
+            self._pending.clear()
+            self._ready.clear()
+            if not self._wait_idle(10.0):
+                print(f"⚠️ Writer for {self.path} is still busy, it will close the file when done")
+            if not self._draining:
+                self._close_file()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+WebSocket Load Generator for the /ws verification protocol
+Opens N concurrent sessions that each replay a fixture recording the way the
+frontend does: video_start, color_change events every 700 ms, one video_chunk
+(JSON envelope + binary frame) per second, then video_end. Reports
+time-to-video_processed, per-chunk send and chunk_ack latency, throttled acks
+and errors for every concurrency level.
+
+Every session replays the same fixture, so run the server with the analysis
+cache off; otherwise every session after the first measures a cache hit.
+
+    ANALYSIS_CACHE=false uvicorn app:app --port 8000 &
+    python load_test.py --url ws://localhost:8000/ws --fixture recording.webm --concurrency 1 5 10 20
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import ssl
+import sys
+import time
+
+import websockets
+
+import protocol
+
+# Same sequence the frontend flashes (see face-verification-ui/src/common/constants.ts)
+SCAN_COLORS = [
+    "#00000000", "#000000", "#0000FF", "#FFFF00", "#00FF00", "#00000000",
+    "#FF0000", "#0000FF", "#00FFFF", "#00FF00", "#00000000",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def split_fixture(data, chunk_count):
+    step = len(data) // chunk_count + 1
+    return [data[i:i + step] for i in range(0, len(data), step)]
+
+
+def build_timeline(chunks, chunk_interval, color_interval, mime_type):
+    """Returns [(offset_s, kind, payload)] with chunks and color changes interleaved in time."""
+    timeline = []
+    for i, chunk in enumerate(chunks):
+        timeline.append(((i + 1) * chunk_interval, "chunk", (i, chunk, mime_type)))
+    duration = len(chunks) * chunk_interval
+    previous = "transparent"
+    offset = 1.0
+    for color in SCAN_COLORS:
+        if offset >= duration:
+            break
+        timeline.append((offset, "color", (previous, color)))
+        previous = color
+        offset += color_interval
+    timeline.sort(key=lambda item: item[0])
+    return timeline
+
+
+class SessionResult:
+    __slots__ = ("ok", "error", "time_to_processed", "chunk_latencies", "ack_latencies", "throttled", "events")
+
+    def __init__(self):
+        self.ok = False
+        self.error = None
+        self.time_to_processed = None
+        self.chunk_latencies = []
+        self.ack_latencies = []
+        self.throttled = 0
+        self.events = []
+
+
+async def run_session(url, timeline, ssl_context, timeout, binary_framing=False):
+    result = SessionResult()
+    try:
+        async with websockets.connect(url, ssl=ssl_context, max_size=None) as ws:
+            hello = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+            if hello.get("event") != "user_id":
+                raise RuntimeError(f"unexpected first message: {hello}")
+            user_id = hello["data"]["user_id"]
+            # Fall back to the JSON envelope + bytes pair if the server doesn't advertise framing
+            framing_versions = hello["data"].get("chunk_framing", {}).get("versions", [])
+            use_frames = binary_framing and protocol.VERSION in framing_versions
+
+            done = asyncio.get_running_loop().create_future()
+            chunk_sent_at = {}
+
+            async def reader():
+                async for raw in ws:
+                    if isinstance(raw, bytes):
+                        continue
+                    message = json.loads(raw)
+                    result.events.append(message.get("event"))
+                    if message.get("event") == "chunk_ack":
+                        ack = message.get("data", {})
+                        sent = chunk_sent_at.pop(ack.get("sequence"), None)
+                        if sent is not None:
+                            result.ack_latencies.append(time.perf_counter() - sent)
+                        if ack.get("throttle"):
+                            result.throttled += 1
+                    if message.get("event") in ("video_processed", "video_failed") and not done.done():
+                        done.set_result((time.perf_counter(), message))
+
+            reader_task = asyncio.create_task(reader())
+            try:
+                video_start = int(time.time() * 1000)
+                await ws.send(json.dumps({"event": "video_start", "data": {"timestamp": video_start, "user_id": user_id}}))
+                started = time.perf_counter()
+                for offset, kind, payload in timeline:
+                    delay = started + offset - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    if kind == "color":
+                        previous, color = payload
+                        await ws.send(json.dumps({"event": "color_change", "data": {
+                            "previousColor": previous,
+                            "newColor": color,
+                            "timestamp": int(time.time() * 1000),
+                            "video_start_time": video_start,
+                            "user_id": user_id,
+                        }}))
+                    else:
+                        sequence, chunk, mime_type = payload
+                        sent = time.perf_counter()
+                        chunk_sent_at[sequence] = sent
+                        if use_frames:
+                            await ws.send(protocol.encode_chunk(chunk, sequence, video_start, int(time.time() * 1000), mime_type))
+                        else:
+                            await ws.send(json.dumps({"event": "video_chunk", "data": {
+                                "startTime": video_start,
+                                "endTime": int(time.time() * 1000),
+                                "mimeType": mime_type,
+                                "sequence": sequence,
+                                "user_id": user_id,
+                            }}))
+                            await ws.send(chunk)
+                        result.chunk_latencies.append(time.perf_counter() - sent)
+
+                await ws.send(json.dumps({"event": "video_end", "data": {"user_id": user_id}}))
+                end_sent_at = time.perf_counter()
+                finished_at, message = await asyncio.wait_for(done, timeout)
+                result.time_to_processed = finished_at - end_sent_at
+                if message["event"] == "video_failed":
+                    result.error = f"video_failed: {message.get('data', {}).get('message')}"
+                else:
+                    result.ok = True
+            finally:
+                reader_task.cancel()
+    except asyncio.TimeoutError:
+        result.error = "timeout waiting for video_processed"
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def run_level(url, timeline, concurrency, sessions, ssl_context, timeout, ramp, binary_framing=False):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(index):
+        # Stagger session starts so they don't all hit the same second
+        await asyncio.sleep(index % concurrency * ramp / max(concurrency, 1))
+        async with semaphore:
+            return await run_session(url, timeline, ssl_context, timeout, binary_framing)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(limited(i) for i in range(sessions)))
+    wall = time.perf_counter() - started
+
+    processed = [r.time_to_processed for r in results if r.ok]
+    chunk_latencies = [lat for r in results for lat in r.chunk_latencies]
+    ack_latencies = [lat for r in results for lat in r.ack_latencies]
+    errors = {}
+    for r in results:
+        if r.error:
+            errors[r.error] = errors.get(r.error, 0) + 1
+    return {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "succeeded": len(processed),
+        "failed": sessions - len(processed),
+        "wall_s": wall,
+        "time_to_processed_s": {p: percentile(processed, p) for p in (50, 95, 99)},
+        "chunk_send_latency_s": {p: percentile(chunk_latencies, p) for p in (50, 95, 99)},
+        "chunk_ack_latency_s": {p: percentile(ack_latencies, p) for p in (50, 95, 99)},
+        "throttled_acks": sum(r.throttled for r in results),
+        "errors": errors,
+    }
+
+
+def _fmt(value):
+    return "   -   " if value is None else f"{value:7.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent /ws load generator")
+    parser.add_argument("--url", default="ws://localhost:8000/ws")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY"))
+    parser.add_argument("--fixture", required=True, help="recording to replay (e.g. a MediaRecorder .webm)")
+    parser.add_argument("--mime-type", default="video/webm;codecs=vp8")
+    parser.add_argument("--chunks", type=int, default=8, help="number of video_chunk messages per session")
+    parser.add_argument("--chunk-interval", type=float, default=1.0, help="seconds between chunks (MediaRecorder timeslice)")
+    parser.add_argument("--color-interval", type=float, default=0.7, help="seconds between color changes")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 5, 10, 20])
+    parser.add_argument("--sessions", type=int, default=None, help="sessions per level (default: 2x concurrency)")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which session starts are spread")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--binary-framing", action="store_true", help="send each chunk as one framed binary message")
+    parser.add_argument("--insecure", action="store_true", help="skip TLS verification for wss:// self-signed certs")
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        print("❌ ERROR: pass --api-key or set API_KEY")
+        sys.exit(1)
+
+    with open(args.fixture, "rb") as f:
+        chunks = split_fixture(f.read(), args.chunks)
+    timeline = build_timeline(chunks, args.chunk_interval, args.color_interval, args.mime_type)
+    separator = "&" if "?" in args.url else "?"
+    url = f"{args.url}{separator}api_key={args.api_key}"
+
+    ssl_context = None
+    if url.startswith("wss://") and args.insecure:
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+    report = []
+    print(f"🚀 Replaying {args.fixture} ({len(chunks)} chunks) against {args.url}")
+    print(f"{'conc':>5}{'ok':>6}{'fail':>6}{'p50 done':>10}{'p95 done':>10}{'p99 done':>10}{'p50 chunk':>11}{'p99 chunk':>11}{'p99 ack':>10}{'throttled':>10}")
+    for concurrency in args.concurrency:
+        sessions = args.sessions or concurrency * 2
+        level = asyncio.run(run_level(url, timeline, concurrency, sessions, ssl_context, args.timeout, args.ramp,
+                                      args.binary_framing))
+        report.append(level)
+        done, chunk, ack = level["time_to_processed_s"], level["chunk_send_latency_s"], level["chunk_ack_latency_s"]
+        print(f"{concurrency:>5}{level['succeeded']:>6}{level['failed']:>6}"
+              f"{_fmt(done[50]):>10}{_fmt(done[95]):>10}{_fmt(done[99]):>10}{_fmt(chunk[50]):>11}{_fmt(chunk[99]):>11}"
+              f"{_fmt(ack[99]):>10}{level['throttled_acks']:>10}")
+        for error, count in level["errors"].items():
+            print(f"      ⚠️ {count}x {error}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"url": args.url, "fixture": args.fixture, "levels": report}, f, indent=2)
+        print(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
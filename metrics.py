@@ -0,0 +1,202 @@
+"""
+Minimal Prometheus-format metrics.
+Counters, gauges and histograms are plain in-process objects guarded by a lock,
+cheap enough for the chunk hot path; render() produces the text exposition
+format served by /metrics.
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), register: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock = threading.Lock()
+        if register:
+            with _registry_lock:
+                _registry.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._new_child()
+                    self._children[key] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """Yields (suffix, labelvalues, extra_label, value)."""
+        if self.labelnames:
+            for labelvalues, child in list(self._children.items()):
+                for suffix, extra, value in child._own_samples():
+                    yield suffix, labelvalues, extra, value
+        else:
+            for suffix, extra, value in self._own_samples():
+                yield suffix, (), extra, value
+
+    def _own_samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for suffix, labelvalues, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labelvalues, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0.0
+
+    def _new_child(self):
+        return Counter(self.name, self.documentation, register=False)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def _own_samples(self):
+        yield "_total", None, self._value
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self):
+        return Gauge(self.name, self.documentation, register=False)
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Evaluates function at scrape time instead of storing a value."""
+        self._function = function
+
+    def _own_samples(self):
+        value = self._value
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                value = math.nan
+        yield "", None, value
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, register: bool = True):
+        super().__init__(name, documentation, labelnames, register)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets, register=False)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def _own_samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield "_bucket", ("le", _format_value(bound)), cumulative
+        yield "_sum", None, total
+        yield "_count", None, cumulative
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# Shared application metrics
+ACTIVE_CONNECTIONS = Gauge("kyc_websocket_connections", "Open /ws connections")
+CHUNKS_RECEIVED = Counter("kyc_chunks_received", "Video chunks received")
+CHUNK_BYTES = Counter("kyc_chunk_bytes", "Video chunk bytes received; use rate() for bytes/sec")
+CHUNKS_PER_SESSION = Histogram("kyc_chunks_per_session", "Video chunks per finished session",
+                               buckets=(1, 2, 5, 10, 15, 20, 30, 60, 120))
+STAGE_SECONDS = Histogram("kyc_stage_duration_seconds", "Duration of pipeline stages", ["stage"])
+QUEUE_DEPTH = Gauge("kyc_worker_queue_depth", "Jobs waiting or running per worker pool", ["pool"])
+JOBS_TOTAL = Counter("kyc_post_processing_jobs", "Finished post-processing jobs", ["status"])
+
+SESSIONS = Gauge("kyc_sessions", "Sessions held in the session registry")
+SESSIONS_EVICTED = Counter("kyc_sessions_evicted", "Sessions evicted from the registry", ["reason"])
+SESSIONS_RESUMED = Counter("kyc_sessions_resumed", "Connections that reattached to a session with a resume token")
+CHUNK_MESSAGES = Counter("kyc_chunk_messages", "Video chunk messages by wire format (binary frame or JSON envelope + bytes)", ["framing"])
+ANALYSIS_CACHE = Counter("kyc_analysis_cache_lookups", "Analysis cache lookups by outcome (memory, disk or miss)", ["result"])
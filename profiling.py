@@ -0,0 +1,122 @@
+"""
+Per-session stage timings and an opt-in sampling profiler.
+stage() times a pipeline step into the kyc_stage_duration_seconds histogram and,
+when a SessionTimings is active on the current thread, into that session's
+breakdown. SamplingProfiler periodically records a thread's Python stack and
+writes collapsed stacks (the flamegraph.pl / speedscope input format).
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import metrics
+
+# Fraction of sessions profiled (0 disables profiling) and the stack sampling interval
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+_local = threading.local()
+
+
+class SessionTimings:
+    """Seconds spent per stage for one session; stages that repeat are summed."""
+
+    def __init__(self):
+        self._stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage_name: str, seconds: float):
+        with self._lock:
+            self._stages[stage_name] = self._stages.get(stage_name, 0.0) + seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(seconds, 4) for name, seconds in self._stages.items()}
+
+
+def current_timings() -> Optional[SessionTimings]:
+    return getattr(_local, "timings", None)
+
+
+@contextmanager
+def activate(timings: SessionTimings):
+    """Makes timings the target of stage() on this thread for the duration of the block."""
+    previous = current_timings()
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+@contextmanager
+def stage(name: str):
+    """Times a pipeline stage. Nested stages are inclusive: analyze contains detect."""
+    timings = current_timings()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.STAGE_SECONDS.labels(stage=name).observe(elapsed)
+        if timings is not None:
+            timings.add(name, elapsed)
+
+
+def should_profile() -> bool:
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class SamplingProfiler:
+    """
+    Samples one thread's stack every interval_ms via sys._current_frames().
+    Cheap enough for production sampling: the profiled thread is never
+    interrupted, and time inside OpenCV/ffmpeg shows up under its Python caller.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval_ms / 1000
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path: str):
+        """Writes one "frame;frame;frame count" line per distinct stack."""
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
@@ -0,0 +1,82 @@
+"""
+Binary framing for video chunks on /ws.
+A framed chunk is a single binary WebSocket message: a fixed big-endian header,
+the MIME type, then the chunk bytes. It replaces the JSON envelope + bytes pair,
+which keeps working for clients that don't opt in.
+
+    offset  size  field
+    0       2     magic b"KV"
+    2       1     version (1)
+    3       1     event type (1 = video_chunk)
+    4       1     flags (bit 0: final chunk of the recording)
+    5       1     reserved, 0
+    6       2     MIME type length in bytes
+    8       4     sequence
+    12      8     startTime, ms since epoch
+    20      8     endTime, ms since epoch
+    28      n     MIME type, UTF-8
+    28+n    ...   chunk bytes
+
+The server advertises the versions it accepts in the user_id message.
+"""
+
+import struct
+from typing import Optional, Tuple
+
+MAGIC = b"KV"
+VERSION = 1
+SUPPORTED_VERSIONS = (1,)
+
+EVENT_VIDEO_CHUNK = 1
+EVENT_NAMES = {EVENT_VIDEO_CHUNK: "video_chunk"}
+
+FLAG_FINAL = 0x01
+
+HEADER = struct.Struct("!2sBBBxHIqq")
+
+
+class FrameError(ValueError):
+    """Raised for binary messages that are not a valid chunk frame."""
+
+
+def is_framed(message: bytes) -> bool:
+    return len(message) >= HEADER.size and message[:2] == MAGIC
+
+
+def encode_chunk(payload: bytes, sequence: int, start_time: int = 0, end_time: int = 0,
+                 mime_type: Optional[str] = None, final: bool = False) -> bytes:
+    mime = (mime_type or "").encode("utf-8")
+    header = HEADER.pack(MAGIC, VERSION, EVENT_VIDEO_CHUNK, FLAG_FINAL if final else 0,
+                         len(mime), sequence, start_time or 0, end_time or 0)
+    return header + mime + payload
+
+
+def decode_frame(message: bytes) -> Tuple[str, dict, memoryview]:
+    """
+    Returns (event, data, payload); data has the same keys as the JSON envelope.
+    The payload is a view into message, so the chunk is not copied.
+    """
+    if not is_framed(message):
+        raise FrameError("missing frame header")
+    magic, version, event_type, flags, mime_length, sequence, start_time, end_time = HEADER.unpack_from(message)
+    if version not in SUPPORTED_VERSIONS:
+        raise FrameError(f"unsupported frame version {version}")
+    if event_type not in EVENT_NAMES:
+        raise FrameError(f"unknown event type {event_type}")
+    payload_offset = HEADER.size + mime_length
+    if len(message) < payload_offset:
+        raise FrameError("truncated frame")
+
+    data = {
+        "sequence": sequence,
+        "startTime": start_time,
+        "endTime": end_time,
+        "mimeType": bytes(message[HEADER.size:payload_offset]).decode("utf-8", errors="replace") or None,
+        "fromEnd": bool(flags & FLAG_FINAL),
+    }
+    return EVENT_NAMES[event_type], data, memoryview(message)[payload_offset:]
+
+
+def advertisement() -> dict:
+    """Capabilities sent to the client in the user_id message."""
+    return {"chunk_framing": {"versions": list(SUPPORTED_VERSIONS)}}
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Bulk Re-analysis of Historical Sessions
+Discovers sessions laid out as download_data/<user>/{images,videos,color_data}
+(see download_kyc_data.py), re-runs the reflection analysis on their extracted
+frames in a process pool and writes per-frame and per-session stats to one
+table: one row per analysed frame, with the session's verdict and metrics
+repeated on each row (sessions that fail get a single row with the error).
+
+Every finished session is appended to a JSONL checkpoint, so an interrupted run
+picks up where it stopped; sessions already analysed with the same parameters
+are skipped. The table is rebuilt from the checkpoint at the end of each run.
+
+    python reanalyze.py --data-dir download_data --output reanalysis.csv --workers 8
+    python reanalyze.py --output reanalysis.parquet --threshold 25 --region face   # needs pandas + pyarrow
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+COLUMNS = [
+    "user_id", "status", "error", "threshold", "region", "decision_rule", "analysis_version",
+    "color_events", "seconds",
+    "session_is_injected", "session_consistency", "session_match_percentage", "session_frames_analyzed",
+    "session_frames_matching_expected", "session_intensity_min", "session_intensity_max",
+    "frame_index", "frame_file", "frame_color", "frame_intensity", "frame_dominant_channel",
+    "frame_affected_pixels", "frame_blue", "frame_green", "frame_red",
+]
+
+
+def discover_sessions(data_dir, users=None):
+    """Returns [(user_id, session_dir)] for every session with extracted frames."""
+    from frames import has_frames
+
+    sessions = []
+    for session_dir in sorted(glob.glob(os.path.join(data_dir, "*"))):
+        user_id = os.path.basename(session_dir)
+        if users and user_id not in users:
+            continue
+        if has_frames(os.path.join(session_dir, "images")):
+            sessions.append((user_id, session_dir))
+    return sessions
+
+
+def load_checkpoint(path):
+    """Returns {user_id: record} from the checkpoint; a line cut off by a crash is ignored."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record["user_id"]] = record
+    return records
+
+
+def _init_worker():
+    # One OpenCV thread per process: the pool provides the parallelism
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def analyze_session(user_id, session_dir, threshold, region):
+    """Runs in a pool process; returns the checkpoint record for one session."""
+    from frames import frame_label, load_frames, select_base_frame
+    from utils import analysis_parameters, compare_frames, decide_injection
+
+    started = time.perf_counter()
+    record = {"user_id": user_id, "parameters": analysis_parameters(threshold, region), "frames": []}
+
+    color_file = os.path.join(session_dir, "color_data", f"{user_id}.json")
+    try:
+        with open(color_file, "r") as f:
+            record["color_events"] = len(json.load(f))
+    except (OSError, ValueError):
+        record["color_events"] = None
+
+    try:
+        base_frame, colored_frames = select_base_frame(load_frames(os.path.join(session_dir, "images")))
+        if base_frame is None or not colored_frames:
+            raise ValueError("Could not find base frame or colored frames")
+        results = compare_frames(base_frame["image"], [(f["color"], frame_label(f), f["image"]) for f in colored_frames],
+                                 user_id, threshold=threshold, render=False, region_focus=region)
+        if not results:
+            raise ValueError("Analysis failed to produce results")
+        verdict = decide_injection(results)
+        record.update(status="success", is_injected=verdict["is_injected"], analysis=verdict["analysis"])
+        record["frames"] = [os.path.basename(r["path"]) for r in results]
+    except Exception as e:
+        record.update(status="error", error=str(e))
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def table_rows(record):
+    """Flattens a checkpoint record into table rows, one per analysed frame."""
+    parameters = record["parameters"]
+    session = {
+        "user_id": record["user_id"],
+        "status": record["status"],
+        "error": record.get("error"),
+        "threshold": parameters["threshold"],
+        "region": parameters["region"],
+        "decision_rule": parameters["decision_rule"],
+        "analysis_version": parameters["analysis"],
+        "color_events": record.get("color_events"),
+        "seconds": record.get("seconds"),
+    }
+    analysis = record.get("analysis")
+    if not analysis:
+        return [session]
+
+    session.update(
+        session_is_injected=record["is_injected"],
+        session_consistency=analysis["consistency"],
+        session_match_percentage=analysis["match_percentage"],
+        session_frames_analyzed=analysis["total_frames_analyzed"],
+        session_frames_matching_expected=analysis["frames_matching_expected"],
+        session_intensity_min=analysis["intensity_range"]["min"],
+        session_intensity_max=analysis["intensity_range"]["max"],
+    )
+    rows = []
+    for index, (frame_file, frame) in enumerate(zip(record["frames"], analysis["frame_details"])):
+        rows.append(dict(
+            session,
+            frame_index=index,
+            frame_file=frame_file,
+            frame_color=frame["color"],
+            frame_intensity=frame["intensity"],
+            frame_dominant_channel=frame["dominant_channel"],
+            frame_affected_pixels=frame["affected_pixels"],
+            frame_blue=frame["channel_values"]["Blue"],
+            frame_green=frame["channel_values"]["Green"],
+            frame_red=frame["channel_values"]["Red"],
+        ))
+    return rows
+
+
+def _require_parquet():
+    try:
+        import pandas  # noqa: F401
+        import pyarrow  # noqa: F401
+    except ImportError:
+        sys.exit("❌ Parquet output needs pandas and pyarrow (pip install pandas pyarrow), or use a .csv output")
+
+
+def write_table(rows, output):
+    if output.endswith(".parquet"):
+        import pandas as pd
+        pd.DataFrame(rows, columns=COLUMNS).to_parquet(output, index=False)
+        return
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-analyse historical sessions in parallel")
+    parser.add_argument("--data-dir", default="download_data", help="directory of <user>/images,color_data sessions")
+    parser.add_argument("--output", default="reanalysis.csv", help=".csv, or .parquet (needs pandas + pyarrow)")
+    parser.add_argument("--checkpoint", default=None, help="JSONL progress file (default: <output>.checkpoint.jsonl)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threshold", type=int, default=20)
+    parser.add_argument("--region", default="full", choices=["full", "face", "forehead", "cheeks"])
+    parser.add_argument("--users", nargs="+", default=None, help="only these user ids")
+    parser.add_argument("--retry-failed", action="store_true", help="re-run sessions that failed in an earlier run")
+    args = parser.parse_args()
+    if args.output.endswith(".parquet"):
+        # Fail before the run rather than after it
+        _require_parquet()
+
+    # Workers import utils from the repo regardless of the working directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from utils import analysis_parameters
+
+    checkpoint = args.checkpoint or f"{os.path.splitext(args.output)[0]}.checkpoint.jsonl"
+    parameters = analysis_parameters(args.threshold, args.region)
+    records = load_checkpoint(checkpoint)
+
+    sessions = discover_sessions(args.data_dir, set(args.users) if args.users else None)
+    todo = []
+    for user_id, session_dir in sessions:
+        done = records.get(user_id)
+        if done and done["parameters"] == parameters and (done["status"] == "success" or not args.retry_failed):
+            continue
+        todo.append((user_id, session_dir))
+    print(f"🔎 {len(sessions)} sessions in {args.data_dir}, {len(sessions) - len(todo)} already in {checkpoint}, "
+          f"{len(todo)} to analyse on {args.workers} workers")
+
+    started = time.perf_counter()
+    finished = failed = 0
+    if todo:
+        pending = iter(todo)
+        in_flight = set()
+        with open(checkpoint, "a") as checkpoint_file, \
+                ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as executor:
+            try:
+                while True:
+                    # Keep a bounded number of sessions queued so memory stays flat on large archives
+                    while len(in_flight) < args.workers * 2:
+                        session = next(pending, None)
+                        if session is None:
+                            break
+                        in_flight.add(executor.submit(analyze_session, *session, args.threshold, args.region))
+                    if not in_flight:
+                        break
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record = future.result()
+                        records[record["user_id"]] = record
+                        checkpoint_file.write(json.dumps(record) + "\n")
+                        checkpoint_file.flush()
+                        finished += 1
+                        if record["status"] != "success":
+                            failed += 1
+                            print(f"⚠️ {record['user_id']}: {record.get('error')}")
+                        if finished % 50 == 0 or finished == len(todo):
+                            elapsed = time.perf_counter() - started
+                            print(f"📊 {finished}/{len(todo)} sessions ({finished / elapsed:.1f}/s)")
+            except KeyboardInterrupt:
+                print("\n⏹️ Interrupted; finished sessions are checkpointed, run again to resume")
+                for future in in_flight:
+                    future.cancel()
+                return 1
+
+    rows = [row for record in records.values() if record["parameters"] == parameters for row in table_rows(record)]
+    write_table(rows, args.output)
+    print(f"✅ {finished} analysed ({failed} failed) in {time.perf_counter() - started:.1f}s; "
+          f"{len(rows)} rows written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
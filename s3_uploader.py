@@ -0,0 +1,217 @@
+"""
+Background S3 upload service.
+Uploads are queued on a bounded queue and sent by a pool of worker threads with
+tuned multipart settings, exponential-backoff retries and a flush on shutdown.
+"""
+
+import io
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
+
+from profiling import stage
+
+MB = 1024 * 1024
+
+# Errors that will not go away by retrying
+NON_RETRYABLE_ERRORS = {"AccessDenied", "NoSuchBucket", "InvalidAccessKeyId", "SignatureDoesNotMatch"}
+
+
+def transfer_config_from_env() -> TransferConfig:
+    return TransferConfig(
+        multipart_threshold=int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8")) * MB,
+        multipart_chunksize=int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "8")) * MB,
+        max_concurrency=int(os.getenv("S3_MULTIPART_CONCURRENCY", "4")),
+        use_threads=True,
+    )
+
+
+class S3Uploader:
+    """
+    Queue-backed uploader. submit_file/submit_bytes return immediately once the
+    upload is queued; stats() reports queued, in-flight, failed and bytes/sec.
+    When the queue is full they wait up to submit_timeout, except when called from
+    an on_complete callback, which drops the upload at once instead.
+    """
+
+    def __init__(self, client, bucket: str, workers: int = 4, max_queue: int = 256,
+                 max_retries: int = 4, backoff_base: float = 0.5, submit_timeout: float = 30.0,
+                 transfer_config: Optional[TransferConfig] = None, throughput_window: float = 60.0):
+        self.client = client
+        self.bucket = bucket
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.submit_timeout = submit_timeout
+        self.transfer_config = transfer_config or transfer_config_from_env()
+        self.throughput_window = throughput_window
+
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._recent = deque()
+        self.counters = {
+            "queued": 0,
+            "in_flight": 0,
+            "completed": 0,
+            "failed": 0,
+            "retries": 0,
+            "rejected": 0,
+            "bytes_uploaded": 0,
+        }
+
+    @classmethod
+    def from_env(cls, client, bucket: str) -> "S3Uploader":
+        return cls(
+            client,
+            bucket,
+            workers=int(os.getenv("S3_UPLOAD_WORKERS", "4")),
+            max_queue=int(os.getenv("S3_UPLOAD_QUEUE_SIZE", "256")),
+            max_retries=int(os.getenv("S3_UPLOAD_MAX_RETRIES", "4")),
+            backoff_base=float(os.getenv("S3_UPLOAD_BACKOFF_SECONDS", "0.5")),
+        )
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"s3-upload-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit_file(self, file_path: str, key: str, extra_args: Optional[Dict[str, Any]] = None,
+                    on_complete: Optional[Callable[[Optional[int]], None]] = None) -> bool:
+        return self._submit({"file_path": file_path, "key": key, "extra_args": extra_args or {}, "on_complete": on_complete})
+
+    def submit_bytes(self, content: bytes, key: str, extra_args: Optional[Dict[str, Any]] = None,
+                     on_complete: Optional[Callable[[Optional[int]], None]] = None) -> bool:
+        return self._submit({"content": content, "key": key, "extra_args": extra_args or {}, "on_complete": on_complete})
+
+    def _submit(self, job: dict) -> bool:
+        with self._lock:
+            self._pending += 1
+        # on_complete callbacks run on the workers; one waiting on its own full queue could
+        # leave no worker to drain it, so uploads submitted from a worker never block
+        on_worker = threading.current_thread() in self._threads
+        try:
+            # Blocks the producer when the queue is full instead of buffering without limit
+            self._queue.put(job, block=not on_worker, timeout=self.submit_timeout)
+        except queue.Full:
+            with self._lock:
+                self._pending -= 1
+                self.counters["rejected"] += 1
+                self._idle.notify_all()
+            print(f"⚠️ S3 upload queue full, dropping upload of {job['key']}")
+            return False
+        with self._lock:
+            self.counters["queued"] = self._queue.qsize()
+        return True
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            with self._lock:
+                self.counters["queued"] = self._queue.qsize()
+                self.counters["in_flight"] += 1
+            try:
+                size = self._upload_with_retries(job)
+                with self._lock:
+                    if size is None:
+                        self.counters["failed"] += 1
+                    else:
+                        self.counters["completed"] += 1
+                        self.counters["bytes_uploaded"] += size
+                        self._recent.append((time.monotonic(), size))
+                if job["on_complete"]:
+                    try:
+                        job["on_complete"](size)
+                    except Exception as e:
+                        print(f"⚠️ S3 upload callback failed for {job['key']}: {e}")
+            finally:
+                with self._lock:
+                    self.counters["in_flight"] -= 1
+                    self._pending -= 1
+                    self._idle.notify_all()
+                self._queue.task_done()
+
+    def _upload_once(self, job: dict) -> int:
+        extra_args = job["extra_args"] or None
+        with stage("upload"):
+            if "file_path" in job:
+                size = os.path.getsize(job["file_path"])
+                self.client.upload_file(job["file_path"], self.bucket, job["key"],
+                                        ExtraArgs=extra_args, Config=self.transfer_config)
+            else:
+                size = len(job["content"])
+                self.client.upload_fileobj(io.BytesIO(job["content"]), self.bucket, job["key"],
+                                           ExtraArgs=extra_args, Config=self.transfer_config)
+        return size
+
+    def _upload_with_retries(self, job: dict) -> Optional[int]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                size = self._upload_once(job)
+                print(f"✅ Uploaded to S3: s3://{self.bucket}/{job['key']}")
+                return size
+            except FileNotFoundError as e:
+                print(f"⚠️ Failed to upload to S3, file is gone: {e}")
+                return None
+            except (ClientError, BotoCoreError, OSError) as e:
+                code = e.response.get("Error", {}).get("Code") if isinstance(e, ClientError) else None
+                if code in NON_RETRYABLE_ERRORS or attempt == self.max_retries:
+                    print(f"⚠️ Failed to upload to S3 after {attempt + 1} attempt(s): {e}")
+                    return None
+                delay = self.backoff_base * (2 ** attempt) * (1 + random.random())
+                with self._lock:
+                    self.counters["retries"] += 1
+                time.sleep(delay)
+        return None
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every queued upload finished; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """Flushes outstanding uploads and stops the workers."""
+        flushed = self.flush(timeout)
+        if not flushed:
+            print(f"⚠️ S3 uploader shut down with {self._pending} upload(s) still pending")
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                # Workers are daemons; whatever is left is abandoned at exit
+                break
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads = []
+        return flushed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0][0] > self.throughput_window:
+                self._recent.popleft()
+            recent_bytes = sum(size for _, size in self._recent)
+            stats = dict(self.counters)
+            stats["queued"] = self._queue.qsize()
+            stats["bytes_per_sec"] = recent_bytes / self.throughput_window
+            return stats
@@ -0,0 +1,276 @@
+"""
+Shared session state.
+The parts of a session other workers need (recording progress, color events,
+post-processing jobs) go through a SessionStore instead of process memory, so
+the backend can run under `uvicorn --workers N`. Sockets, file handles and
+ffmpeg processes stay local.
+
+    SESSION_STORE=memory   single process (default)
+    SESSION_STORE=sqlite   SQLite file at SESSION_STORE_PATH, shared by the
+                           worker processes of one host
+
+SQLite's WAL mode relies on shared memory between the processes, so the file
+must be on a local disk: it does not work over NFS or other network
+filesystems, and replicas on different hosts cannot share it.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+
+class SessionStore(ABC):
+    """Interface; all values are JSON-serializable dicts."""
+
+    # True when calls can wait on I/O or locks; the event loop then makes them from a thread
+    blocking = False
+
+    @abstractmethod
+    def save_session(self, user_id: str, state: dict):
+        ...
+
+    @abstractmethod
+    def load_session(self, user_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def delete_session(self, user_id: str):
+        ...
+
+    @abstractmethod
+    def append_color_event(self, user_id: str, entry: dict):
+        ...
+
+    @abstractmethod
+    def color_events(self, user_id: str) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def clear_color_events(self, user_id: str):
+        ...
+
+    @abstractmethod
+    def save_job(self, job_id: str, job: dict):
+        ...
+
+    @abstractmethod
+    def load_job(self, job_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Takes (or renews) a named lease; False while another owner holds it."""
+
+    @abstractmethod
+    def release_lease(self, name: str, owner: str):
+        ...
+
+    @abstractmethod
+    def purge_expired(self, max_idle: float, job_ttl: float = 86400.0) -> int:
+        """Drops sessions and color events idle for max_idle seconds and jobs older than job_ttl."""
+
+    def close(self):
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local store; the behaviour of a single worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, dict] = {}
+        self._color_events: Dict[str, List[dict]] = {}
+        self._jobs: Dict[str, dict] = {}
+        self._leases: Dict[str, tuple] = {}
+        self._touched: Dict[str, float] = {}
+
+    def save_session(self, user_id, state):
+        with self._lock:
+            self._sessions[user_id] = dict(state)
+            self._touched[user_id] = time.time()
+
+    def load_session(self, user_id):
+        with self._lock:
+            state = self._sessions.get(user_id)
+            return dict(state) if state is not None else None
+
+    def delete_session(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def append_color_event(self, user_id, entry):
+        with self._lock:
+            self._color_events.setdefault(user_id, []).append(dict(entry))
+            self._touched[user_id] = time.time()
+
+    def color_events(self, user_id):
+        with self._lock:
+            return [dict(entry) for entry in self._color_events.get(user_id, [])]
+
+    def clear_color_events(self, user_id):
+        with self._lock:
+            self._color_events.pop(user_id, None)
+
+    def save_job(self, job_id, job):
+        with self._lock:
+            self._jobs[job_id] = dict(job, _saved_at=time.time())
+
+    def load_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {k: v for k, v in job.items() if k != "_saved_at"}
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            holder = self._leases.get(name)
+            if holder and holder[0] != owner and holder[1] > now:
+                return False
+            self._leases[name] = (owner, now + ttl)
+            return True
+
+    def release_lease(self, name, owner):
+        with self._lock:
+            if self._leases.get(name, (None,))[0] == owner:
+                del self._leases[name]
+
+    def purge_expired(self, max_idle, job_ttl=86400.0):
+        now = time.time()
+        with self._lock:
+            idle = [user_id for user_id, touched in self._touched.items() if now - touched > max_idle]
+            for user_id in idle:
+                self._sessions.pop(user_id, None)
+                self._color_events.pop(user_id, None)
+                del self._touched[user_id]
+            old_jobs = [job_id for job_id, job in self._jobs.items() if now - job["_saved_at"] > job_ttl]
+            for job_id in old_jobs:
+                del self._jobs[job_id]
+            for name in [name for name, (_, expires_at) in self._leases.items() if expires_at < now]:
+                del self._leases[name]
+            return len(idle) + len(old_jobs)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite in WAL mode, one connection per thread. Shared by processes on one
+    host; the file must be on a local disk, not a network filesystem.
+    """
+
+    blocking = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS color_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL,
+            entry TEXT NOT NULL, created_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS color_events_user ON color_events (user_id, id);
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _execute(self, sql, params=()):
+        return self._connection().execute(sql, params)
+
+    def save_session(self, user_id, state):
+        self._execute(
+            "INSERT INTO sessions (user_id, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (user_id, json.dumps(state), time.time()))
+
+    def load_session(self, user_id):
+        row = self._execute("SELECT state FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete_session(self, user_id):
+        self._execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def append_color_event(self, user_id, entry):
+        self._execute("INSERT INTO color_events (user_id, entry, created_at) VALUES (?, ?, ?)",
+                      (user_id, json.dumps(entry), time.time()))
+
+    def color_events(self, user_id):
+        rows = self._execute("SELECT entry FROM color_events WHERE user_id = ? ORDER BY id", (user_id,))
+        return [json.loads(entry) for entry, in rows]
+
+    def clear_color_events(self, user_id):
+        self._execute("DELETE FROM color_events WHERE user_id = ?", (user_id,))
+
+    def save_job(self, job_id, job):
+        self._execute(
+            "INSERT INTO jobs (job_id, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (job_id, json.dumps(job), time.time()))
+
+    def load_job(self, job_id):
+        row = self._execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        cursor = self._execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+            (name, owner, now + ttl, now))
+        return cursor.rowcount > 0
+
+    def release_lease(self, name, owner):
+        self._execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def purge_expired(self, max_idle, job_ttl=86400.0):
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            purged = connection.execute("DELETE FROM sessions WHERE updated_at < ?", (now - max_idle,)).rowcount
+            # Events of sessions that are gone and saw no new event for max_idle
+            connection.execute(
+                "DELETE FROM color_events WHERE user_id NOT IN (SELECT user_id FROM sessions) "
+                "AND user_id NOT IN (SELECT user_id FROM color_events WHERE created_at >= ?)",
+                (now - max_idle,))
+            purged += connection.execute("DELETE FROM jobs WHERE updated_at < ?", (now - job_ttl,)).rowcount
+            connection.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+        return purged
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def create_session_store(kind: Optional[str] = None, path: Optional[str] = None) -> SessionStore:
+    kind = (kind or os.getenv("SESSION_STORE", "memory")).lower()
+    if kind == "sqlite":
+        return SQLiteSessionStore(path or os.getenv("SESSION_STORE_PATH", os.path.join("data", "sessions.db")))
+    if kind != "memory":
+        print(f"⚠️ Unknown SESSION_STORE {kind!r}, using in-memory session state")
+    return InMemorySessionStore()
@@ -0,0 +1,243 @@
+"""
+Registry of in-flight verification sessions.
+Replaces the unbounded user_data/user_locks dicts: sessions are compact slotted
+objects, capped in number, and evicted once idle or too old. Eviction closes the
+chunk writer, aborts the streaming transcoder and hands the session to an
+on_evict callback so the partial recording on disk can be removed.
+With a SessionStore, a session unknown to this process is restored from the
+shared state another worker saved (see Session.to_state).
+Resume tokens let a client that lost its connection reattach to its session.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import metrics
+
+
+class SessionLimitExceeded(Exception):
+    """Raised when a new session would exceed the registry's cap."""
+
+
+def _sign(secret: str, payload: str) -> str:
+    return hmac.new(secret.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def issue_resume_token(user_id: str, secret: str, ttl: float) -> str:
+    """Signed "<user_id>.<expiry>.<signature>"; any worker with the secret can verify it."""
+    payload = f"{user_id}.{int(time.time() + ttl)}"
+    return f"{payload}.{_sign(secret, payload)}"
+
+
+def verify_resume_token(token: str, secret: str) -> Optional[str]:
+    """Returns the token's user_id, or None if it is malformed, forged or expired."""
+    try:
+        user_id, expires_at, signature = token.rsplit(".", 2)
+        expires_at = int(expires_at)
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(signature, _sign(secret, f"{user_id}.{expires_at}")):
+        return None
+    if expires_at < time.time():
+        return None
+    return user_id
+
+
+class Session:
+    __slots__ = (
+        "user_id", "lock", "aggregate_path", "mime_type", "num_chunks", "persisted_sequence",
+        "bytes_written", "writer", "transcoder", "receive_seconds", "created_at", "last_seen",
+    )
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self.aggregate_path: Optional[str] = None
+        self.mime_type: Optional[str] = None
+        self.num_chunks = 0
+        # Progress of the aggregate file on disk, as reported by the writer
+        self.persisted_sequence = -1
+        self.bytes_written = 0
+        self.writer = None
+        self.transcoder = None
+        self.receive_seconds = 0.0
+        self.created_at = time.monotonic()
+        self.last_seen = self.created_at
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    @property
+    def recording(self) -> bool:
+        """True between the first video chunk and video_end."""
+        return self.aggregate_path is not None
+
+    def reset(self):
+        """Clears the recording state once video_end has taken it over."""
+        self.aggregate_path = None
+        self.mime_type = None
+        self.num_chunks = 0
+        self.persisted_sequence = -1
+        self.bytes_written = 0
+        self.writer = None
+        self.transcoder = None
+        self.receive_seconds = 0.0
+
+    def close(self):
+        """Closes the chunk writer and stops the streaming transcoder; files are left to on_evict."""
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        if self.transcoder is not None:
+            try:
+                self.transcoder.abort()
+            except Exception as e:
+                print(f"⚠️ Failed to abort transcoder for user {self.user_id}: {e}")
+            self.transcoder = None
+
+    def to_state(self, owner: str) -> dict:
+        """The part of the session another worker needs to continue the recording."""
+        return {
+            "owner": owner,
+            "aggregate_path": self.aggregate_path,
+            "mime_type": self.mime_type,
+            "num_chunks": self.num_chunks,
+            "persisted_sequence": self.persisted_sequence,
+            "bytes_written": self.bytes_written,
+        }
+
+    def restore(self, state: dict):
+        self.aggregate_path = state.get("aggregate_path")
+        self.mime_type = state.get("mime_type")
+        self.num_chunks = state.get("num_chunks", 0)
+        self.persisted_sequence = state.get("persisted_sequence", -1)
+        self.bytes_written = state.get("bytes_written", 0)
+
+    def approx_bytes(self) -> int:
+        size = sys.getsizeof(self)
+        if self.writer is not None:
+            size += self.writer.buffered_bytes
+        return size
+
+
+class SessionRegistry:
+    """
+    Thread-safe map of user_id -> Session.
+    Sessions idle for more than idle_ttl seconds, or older than max_age, are
+    evicted by evict_expired() (run periodically by reap_forever()).
+    """
+
+    def __init__(self, max_sessions: int = 500, idle_ttl: float = 600.0, max_age: float = 3600.0,
+                 on_evict: Optional[Callable[[Session, str], None]] = None, store=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_age = max_age
+        self.on_evict = on_evict
+        self.store = store
+        self._sessions: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, user_id):
+        return user_id in self._sessions
+
+    def get(self, user_id: str) -> Optional[Session]:
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.touch()
+        return session
+
+    def get_or_create(self, user_id: str) -> Session:
+        session = self.get(user_id)
+        if session is not None:
+            return session
+        if len(self._sessions) >= self.max_sessions:
+            self.evict_expired()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions:
+                    raise SessionLimitExceeded(f"{len(self._sessions)} sessions open (limit {self.max_sessions})")
+                session = self._sessions[user_id] = Session(user_id)
+                state = self.store.load_session(user_id) if self.store else None
+                if state:
+                    session.restore(state)
+                    print(f"🔁 Restored session {user_id} from the session store")
+            return session
+
+    def remove(self, user_id: str) -> Optional[Session]:
+        """Drops a finished session without running on_evict."""
+        with self._lock:
+            return self._sessions.pop(user_id, None)
+
+    def evict(self, user_id: str, reason: str = "manual") -> bool:
+        """
+        Evicts a session unless another thread is using it right now.
+        Returns True when the session was evicted.
+        """
+        session = self._sessions.get(user_id)
+        if session is None or not session.lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                if self._sessions.get(user_id) is not session:
+                    return False
+                del self._sessions[user_id]
+            session.close()
+            if self.on_evict:
+                try:
+                    self.on_evict(session, reason)
+                except Exception as e:
+                    print(f"⚠️ Session eviction cleanup failed for user {user_id}: {e}")
+        finally:
+            session.lock.release()
+        metrics.SESSIONS_EVICTED.labels(reason=reason).inc()
+        print(f"🧹 Evicted session {user_id} ({reason})")
+        return True
+
+    def evict_expired(self, now: Optional[float] = None) -> List[str]:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            candidates = []
+            for user_id, session in self._sessions.items():
+                if now - session.last_seen > self.idle_ttl:
+                    candidates.append((user_id, "idle"))
+                elif now - session.created_at > self.max_age:
+                    candidates.append((user_id, "max_age"))
+        return [user_id for user_id, reason in candidates if self.evict(user_id, reason)]
+
+    def memory_report(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            "sessions": len(sessions),
+            "max_sessions": self.max_sessions,
+            "recording": sum(1 for s in sessions if s.recording),
+            "approx_bytes": sum(s.approx_bytes() for s in sessions),
+            "oldest_session_age_s": round(max((now - s.created_at for s in sessions), default=0.0), 1),
+            "idle_ttl_s": self.idle_ttl,
+            "max_age_s": self.max_age,
+        }
+
+    async def reap_forever(self, interval: float = 30.0):
+        """
+        Evicts expired sessions every interval seconds, and purges shared state
+        no worker touched for max_age; both run off the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(None, self.evict_expired)
+                if self.store:
+                    await loop.run_in_executor(None, self.store.purge_expired, self.max_age)
+            except Exception as e:
+                print(f"⚠️ Session reaper failed: {e}")
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Threshold and Decision-Rule Sweep
+Tunes the reflection analysis without re-running the pipeline per setting.
+Faces are detected and aligned once per session (in a process pool) and the
+threshold-independent per-frame inputs of the verdict are stored as
+<features-dir>/<user>.npz (see utils.reflection_features), together with the
+analysis parameters they depend on; a cache written with other parameters is
+recomputed. Every combination of threshold, region and decision cutoffs is then
+evaluated for all sessions at once with NumPy.
+
+The rule evaluated is decide_injection's, generalised with one extra cutoff:
+
+    genuine = matches >= frames * match_cutoff  or  consistency > consistency_cutoff
+
+where a frame counts as a match when its dominant channel is the expected one
+and at least min_affected % of its pixels differ by more than the threshold.
+With min_affected=0 this is decide_injection exactly; the threshold only
+enters the verdict through min_affected.
+
+For every grid point the table reports the injected rate and how many verdicts
+flip against the current settings; with --labels (CSV of user_id,label where
+label is injected/genuine or 1/0) also overall and per-label accuracy.
+
+    python sweep.py --data-dir download_data --thresholds 10 20 30 --regions full face cheeks \\
+        --min-affected 0 5 10 --match-cutoffs 0.3 0.5 0.7 --consistency-cutoffs 30 50 70 \\
+        --labels labels.csv --output sweep.csv
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+from reanalyze import _init_worker, discover_sessions  # noqa: E402
+
+REGIONS = ["full", "face", "forehead", "cheeks"]
+CHANNELS = np.array(["Blue", "Green", "Red"])  # BGR order in OpenCV
+
+
+def feature_parameters():
+    """The analysis_parameters() the features depend on, as stored in the .npz; the rest is swept."""
+    from utils import analysis_parameters
+
+    parameters = analysis_parameters()
+    return json.dumps({key: parameters[key] for key in ("analysis", "face_detector", "face_detection_max_dim")},
+                      sort_keys=True)
+
+
+def extract_features(user_id, session_dir, regions, features_path):
+    """Runs in a pool process: writes the session's features to features_path, or returns an error."""
+    from frames import load_frames, select_base_frame
+    from utils import reflection_features
+
+    base_frame, colored_frames = select_base_frame(load_frames(os.path.join(session_dir, "images")))
+    if base_frame is None or not colored_frames:
+        return user_id, "Could not find base frame or colored frames"
+    colors = [frame["color"] for frame in colored_frames]
+
+    features = reflection_features(base_frame["image"], [frame["image"] for frame in colored_frames], regions)
+    if features is None:
+        return user_id, "Failed to extract face regions"
+    arrays = {"colors": np.array(colors), "parameters": np.array(feature_parameters())}
+    for region, values in features.items():
+        for name, value in values.items():
+            arrays[f"{region}.{name}"] = value
+    temp_path = f"{features_path}.{os.getpid()}.tmp.npz"
+    np.savez(temp_path, **arrays)
+    os.replace(temp_path, features_path)
+    return user_id, None
+
+
+def load_features(paths, regions):
+    """
+    Stacks per-session features, padded to the longest session:
+    colors (S, N), intensity (S, R, N), channel_means (S, R, N, 3), hist (S, R, N, 256), frames (S,).
+    """
+    loaded = []
+    for path in paths:
+        # Copied out so that only one file is open at a time
+        with np.load(path) as f:
+            loaded.append({name: f[name] for name in f.files})
+    count = max(len(f["colors"]) for f in loaded)
+    sessions = len(loaded)
+    colors = np.full((sessions, count), "", dtype=object)
+    intensity = np.zeros((sessions, len(regions), count))
+    channel_means = np.zeros((sessions, len(regions), count, 3))
+    hist = np.zeros((sessions, len(regions), count, 256), dtype=np.int64)
+    frames = np.zeros(sessions, dtype=np.int64)
+    for s, f in enumerate(loaded):
+        n = len(f["colors"])
+        frames[s] = n
+        colors[s, :n] = f["colors"]
+        for r, region in enumerate(regions):
+            intensity[s, r, :n] = f[f"{region}.intensity"]
+            channel_means[s, r, :n] = f[f"{region}.channel_means"]
+            hist[s, r, :n] = f[f"{region}.max_diff_hist"]
+    return colors, intensity, channel_means, hist, frames
+
+
+def evaluate(features, thresholds, min_affected, match_cutoffs, consistency_cutoffs):
+    """
+    Vectorised verdicts for every grid point.
+    Returns injected (S, R, T, A, M, C) and valid (S, R): sessions whose intensities
+    are all zero have no defined consistency and are left out, as decide_injection fails on them.
+    """
+    from utils import EXPECTED_CHANNELS
+
+    colors, intensity, channel_means, hist, frames = features
+    present = np.arange(colors.shape[1])[None, :] < frames[:, None]                    # (S, N)
+
+    expected = np.vectorize(lambda color: EXPECTED_CHANNELS.get(color, ""), otypes=[object])(colors)
+    dominant = CHANNELS[channel_means.argmax(axis=3)]                                  # (S, R, N)
+    expected_match = (dominant == expected[:, None, :]) & present[:, None, :]
+
+    masked = np.where(present[:, None, :], intensity, np.nan)
+    highest, lowest = np.nanmax(masked, axis=2), np.nanmin(masked, axis=2)            # (S, R)
+    valid = highest > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        consistency = 100 * (1 - (highest - lowest) / highest)
+
+    # Pixels whose largest channel diff exceeds t, for every threshold: reversed cumulative histogram
+    above = hist[..., ::-1].cumsum(axis=3)[..., ::-1]                                  # (S, R, N, 256): count >= k
+    pixels = np.maximum(hist.sum(axis=3), 1)
+    index = np.minimum(np.asarray(thresholds) + 1, 255)
+    affected = 100 * above[..., index] / pixels[..., None]                             # (S, R, N, T)
+    affected[..., np.asarray(thresholds) >= 255] = 0
+    affected = np.moveaxis(affected, 3, 2)                                             # (S, R, T, N)
+
+    counts = (expected_match[:, :, None, None, :]
+              & (affected[:, :, :, None, :] >= np.asarray(min_affected)[None, None, None, :, None])).sum(axis=4)
+    by_matches = counts[..., None, None] >= frames[:, None, None, None, None, None] * np.asarray(match_cutoffs)[:, None]
+    by_consistency = consistency[:, :, None, None, None, None] > np.asarray(consistency_cutoffs)
+    return ~(by_matches | by_consistency), valid
+
+
+def read_labels(path):
+    """{user_id: injected} from a CSV with user_id,label columns."""
+    truthy = {"1", "true", "yes", "injected", "fake", "spoof"}
+    falsy = {"0", "false", "no", "genuine", "real", "live"}
+    labels = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            value = str(row.get("label", "")).strip().lower()
+            if value in truthy or value in falsy:
+                labels[row["user_id"].strip()] = value in truthy
+    return labels
+
+
+def main():
+    from utils import CONSISTENCY_CUTOFF, MATCH_CUTOFF
+
+    parser = argparse.ArgumentParser(description="Sweep analysis thresholds, regions and decision cutoffs")
+    parser.add_argument("--data-dir", default="download_data", help="directory of <user>/images sessions")
+    parser.add_argument("--output", default="sweep.csv")
+    parser.add_argument("--features-dir", default=None, help="per-session feature cache (default: <output>_features)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--thresholds", nargs="+", type=int, default=[10, 15, 20, 25, 30, 40])
+    parser.add_argument("--regions", nargs="+", choices=REGIONS, default=REGIONS)
+    parser.add_argument("--min-affected", nargs="+", type=float, default=[0.0],
+                        help="share of pixels (%%) above the threshold for a frame to count as a match")
+    parser.add_argument("--match-cutoffs", nargs="+", type=float, default=[0.3, 0.4, 0.5, 0.6, 0.7])
+    parser.add_argument("--consistency-cutoffs", nargs="+", type=float, default=[30, 40, 50, 60, 70])
+    parser.add_argument("--labels", default=None, help="CSV with user_id,label (injected/genuine or 1/0)")
+    parser.add_argument("--users", nargs="+", default=None, help="only these user ids")
+    args = parser.parse_args()
+
+    features_dir = args.features_dir or f"{os.path.splitext(args.output)[0]}_features"
+    os.makedirs(features_dir, exist_ok=True)
+    # Baseline: what the server decides today
+    regions = list(dict.fromkeys(args.regions + ["full"]))
+
+    sessions = discover_sessions(args.data_dir, set(args.users) if args.users else None)
+    paths = {user_id: os.path.join(features_dir, f"{user_id}.npz") for user_id, _ in sessions}
+
+    parameters = feature_parameters()
+
+    def is_cached(path):
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as f:
+            return ("parameters" in f.files and str(f["parameters"]) == parameters
+                    and all(f"{region}.intensity" in f.files for region in regions))
+
+    todo = [(user_id, session_dir) for user_id, session_dir in sessions if not is_cached(paths[user_id])]
+    print(f"🔎 {len(sessions)} sessions, {len(sessions) - len(todo)} with cached features, "
+          f"{len(todo)} to extract on {args.workers} workers")
+
+    started = time.perf_counter()
+    failed = {}
+    if todo:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as executor:
+            futures = [executor.submit(extract_features, user_id, session_dir, regions, paths[user_id])
+                       for user_id, session_dir in todo]
+            for done, future in enumerate(as_completed(futures), 1):
+                user_id, error = future.result()
+                if error:
+                    failed[user_id] = error
+                if done % 100 == 0 or done == len(todo):
+                    print(f"📊 {done}/{len(todo)} sessions extracted ({time.perf_counter() - started:.1f}s)")
+    for user_id, error in failed.items():
+        print(f"⚠️ {user_id}: {error}")
+
+    users = [user_id for user_id, _ in sessions if user_id not in failed and os.path.exists(paths[user_id])]
+    if not users:
+        print("❌ No sessions with usable frames")
+        return 1
+
+    evaluated_at = time.perf_counter()
+    features = load_features([paths[user_id] for user_id in users], regions)
+    grid_regions = [regions.index(region) for region in args.regions]
+    injected, valid = evaluate(features, args.thresholds, args.min_affected, args.match_cutoffs,
+                               args.consistency_cutoffs)
+    baseline, _ = evaluate(features, [20], [0.0], [MATCH_CUTOFF], [CONSISTENCY_CUTOFF])
+    baseline = baseline[:, regions.index("full"), 0, 0, 0, 0]                          # (S,)
+
+    labels = read_labels(args.labels) if args.labels else {}
+    labeled = np.array([user_id in labels for user_id in users])
+    truth = np.array([labels.get(user_id, False) for user_id in users])
+
+    rows = []
+    grid = itertools.product(enumerate(args.thresholds), grid_regions, enumerate(args.min_affected),
+                             enumerate(args.match_cutoffs), enumerate(args.consistency_cutoffs))
+    for (t, threshold), r, (a, min_affected), (m, match_cutoff), (c, consistency_cutoff) in grid:
+        ok = valid[:, r]
+        predicted = injected[:, r, t, a, m, c]
+        row = {
+            "threshold": threshold,
+            "region": regions[r],
+            "min_affected": min_affected,
+            "match_cutoff": match_cutoff,
+            "consistency_cutoff": consistency_cutoff,
+            "sessions": int(ok.sum()),
+            "injected": int((predicted & ok).sum()),
+            "injected_rate": round(float((predicted & ok).sum() / max(ok.sum(), 1)), 4),
+            "flips_vs_current": int(((predicted != baseline) & ok).sum()),
+            "labeled": int((labeled & ok).sum()),
+        }
+        if labels:
+            scored = labeled & ok
+            positives, negatives = scored & truth, scored & ~truth
+            row["accuracy"] = round(float((predicted == truth)[scored].mean()), 4) if scored.any() else None
+            row["accuracy_injected"] = round(float(predicted[positives].mean()), 4) if positives.any() else None
+            row["accuracy_genuine"] = round(float((~predicted)[negatives].mean()), 4) if negatives.any() else None
+        row["is_current"] = (threshold, regions[r], min_affected, match_cutoff, consistency_cutoff) == \
+            (20, "full", 0.0, MATCH_CUTOFF, CONSISTENCY_CUTOFF)
+        rows.append(row)
+
+    if labels:
+        rows.sort(key=lambda row: row["accuracy"] if row["accuracy"] is not None else -1, reverse=True)
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"✅ {len(rows)} settings x {len(users)} sessions evaluated in {time.perf_counter() - evaluated_at:.2f}s "
+          f"(current settings flag {int(baseline.sum())} as injected); table written to {args.output}")
+    if labels:
+        for row in rows[:5]:
+            print(f"   accuracy {row['accuracy']}: threshold={row['threshold']} region={row['region']} "
+                  f"min_affected={row['min_affected']} match_cutoff={row['match_cutoff']} "
+                  f"consistency_cutoff={row['consistency_cutoff']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
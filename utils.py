@@ -1,13 +1,118 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
-import colorsys
 import os
+import threading
 from pathlib import Path
 import json
 import datetime
 
+from profiling import stage
+
+# Face detector configuration: "haar" (bundled cascade) or "yunet" (OpenCV DNN, needs FACE_DETECTOR_MODEL)
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "haar").lower()
+FACE_DETECTOR_MODEL = os.getenv("FACE_DETECTOR_MODEL", "")
+# Detection runs on a copy whose longest side is at most this many pixels (0 disables downscaling)
+FACE_DETECTION_MAX_DIM = int(os.getenv("FACE_DETECTION_MAX_DIM", "640"))
+# Bump whenever the per-frame analysis changes (analyze_reflection_batch, analyze_reflection,
+# quantize_colors, face alignment), so cached verdicts are recomputed
+ANALYSIS_VERSION = 1
+
+_detector_local = threading.local()
+# pyplot keeps global figure state, so rendering from several worker threads is serialized
+_render_lock = threading.Lock()
+
+
+class HaarFaceDetector:
+    """Bundled Haar cascade; works on the grayscale copy."""
+
+    def __init__(self, cascade_path=None):
+        cascade_path = cascade_path or cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        self.classifier = cv2.CascadeClassifier(cascade_path)
+        if self.classifier.empty():
+            raise ValueError(f"Could not load Haar cascade from {cascade_path}")
+
+    def detect(self, image, gray):
+        return [tuple(int(v) for v in face) for face in self.classifier.detectMultiScale(gray, 1.1, 5)]
+
+
+class YuNetFaceDetector:
+    """OpenCV DNN face detector (YuNet ONNX model); works on the color copy."""
+
+    def __init__(self, model_path, score_threshold=0.8):
+        if not model_path or not os.path.exists(model_path):
+            raise ValueError(f"YuNet model not found: {model_path!r}")
+        self.detector = cv2.FaceDetectorYN.create(model_path, "", (320, 320), score_threshold)
+
+    def detect(self, image, gray):
+        height, width = image.shape[:2]
+        self.detector.setInputSize((width, height))
+        _, faces = self.detector.detect(image)
+        if faces is None:
+            return []
+        return [tuple(int(v) for v in face[:4]) for face in faces]
+
+
+def get_face_detector(name=None, model_path=None):
+    """
+    Returns the face detector for the current thread, loading the model on first use.
+    Falls back to the Haar cascade if the requested detector cannot be loaded.
+    """
+    name = (name or FACE_DETECTOR).lower()
+    model_path = model_path if model_path is not None else FACE_DETECTOR_MODEL
+    cache = getattr(_detector_local, "detectors", None)
+    if cache is None:
+        cache = _detector_local.detectors = {}
+
+    key = (name, model_path)
+    detector = cache.get(key)
+    if detector is None:
+        if name == "yunet":
+            try:
+                detector = YuNetFaceDetector(model_path)
+            except Exception as e:
+                print(f"Warning: YuNet face detector unavailable ({e}), falling back to Haar cascade")
+                detector = get_face_detector("haar")
+        else:
+            detector = HaarFaceDetector()
+        cache[key] = detector
+    return detector
+
+
+def detect_faces(image, max_dim=None):
+    """
+    Detect faces on a downscaled copy of the image.
+    Returns (x, y, w, h) boxes in full-resolution coordinates.
+    """
+    max_dim = FACE_DETECTION_MAX_DIM if max_dim is None else max_dim
+    height, width = image.shape[:2]
+    scale = 1.0
+    if max_dim and max(height, width) > max_dim:
+        scale = max_dim / max(height, width)
+        small = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    else:
+        small = image
+
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    with stage("detect"):
+        faces = get_face_detector().detect(small, gray)
+    if scale == 1.0:
+        return faces
+    return [(int(x / scale), int(y / scale), int(w / scale), int(h / scale)) for x, y, w, h in faces]
+
+
+def warmup():
+    """
+    Loads this thread's face detector and runs the OpenCV and NumPy kernels used
+    by the analysis once on a synthetic frame, so the first session doesn't pay for it.
+    Bypasses detect_faces so the stage metrics only see real sessions.
+    """
+    frame = np.full((480, 640, 3), 128, dtype=np.uint8)
+    small = cv2.resize(frame, (320, 240), interpolation=cv2.INTER_AREA)
+    get_face_detector().detect(small, cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+    cv2.absdiff(frame, frame)
+    quantize_colors(frame.reshape(-1, 3))
+
+
 def extract_face_region(image):
     """
     Extract the face region from an image using a face detector.
@@ -17,14 +122,8 @@ def extract_face_region(image):
         print("Error: Invalid image provided to face detection")
         return None, None
     
-    # Convert to grayscale for face detection
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    # Load face detector
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    
-    # Detect faces
-    faces = face_cascade.detectMultiScale(gray, 1.1, 5)
+    # Detect faces (cached per-thread detector, downscaled grayscale copy)
+    faces = detect_faces(image)
     
     if len(faces) > 0:
         # Take the largest face
@@ -124,7 +223,7 @@ def extract_face_region(image):
 #         return []
 def get_dominant_colors(image, n_colors=5, debug=False):
     """
-    Extract the dominant colors from an image using K-means clustering.
+    Extract the dominant colors from an image using histogram-based quantization.
     """
     if image is None or image.size == 0:
         print("Warning: Empty image provided to color analysis")
@@ -156,6 +255,7 @@ def get_dominant_colors(image, n_colors=5, debug=False):
     pixels = image.reshape(-1, 3)
     
     if debug:
+        import matplotlib.pyplot as plt
         # Visualize effects of different black pixel thresholds
         thresholds = [10, 20, 30, 40, 50]
         plt.figure(figsize=(15, 8))
@@ -247,27 +347,78 @@ def get_dominant_colors(image, n_colors=5, debug=False):
             return []
         n_colors = max(1, len(non_black_pixels))
     
-    # Perform K-means clustering
+    # Histogram-based color quantization (replaces K-means, same output format)
     try:
-        kmeans = KMeans(n_clusters=n_colors, random_state=42, n_init=10)
-        kmeans.fit(non_black_pixels)
-        
-        # Get the colors
-        colors = kmeans.cluster_centers_.astype(int)
-        
-        # Get the percentage of each color
-        labels = kmeans.labels_
-        counts = np.bincount(labels)
-        percentages = counts / len(labels) * 100
-        
+        colors, percentages = quantize_colors(non_black_pixels, n_colors=n_colors)
         return list(zip(colors, percentages))
     except Exception as e:
         print(f"Error in color clustering: {e}")
         return []
+
+def quantize_colors(pixels, n_colors=5, bins_per_channel=8, max_samples=20000, seed=42):
+    """
+    Fast dominant-color quantizer using histogram binning.
+    The most populated, mutually non-adjacent color bins seed the centers, then a
+    single nearest-center pass assigns every pixel and refines the centers. Pixels are randomly
+    subsampled to max_samples (deterministic for a given seed; 0 keeps all).
+    Returns (centers as int array, percentages), sorted by percentage.
+    Changes to the result must bump ANALYSIS_VERSION.
+    """
+    pixels = np.asarray(pixels).reshape(-1, 3)
+    if len(pixels) == 0:
+        return np.empty((0, 3), dtype=int), np.empty(0)
+
+    if max_samples and len(pixels) > max_samples:
+        rng = np.random.default_rng(seed)
+        pixels = pixels[rng.choice(len(pixels), max_samples, replace=False)]
+
+    values = np.clip(pixels, 0, 255).astype(np.float32)
+
+    # Bin each channel and count pixels per (b, g, r) cell
+    binned = (values * bins_per_channel / 256).astype(np.int64)
+    bin_index = (binned[:, 0] * bins_per_channel + binned[:, 1]) * bins_per_channel + binned[:, 2]
+    n_bins = bins_per_channel ** 3
+    bin_counts = np.bincount(bin_index, minlength=n_bins)
+
+    # Seed from the most populated bins, skipping neighbours of already chosen bins
+    # so one large cluster spread over adjacent bins does not take every seed
+    occupied = np.argsort(bin_counts)[::-1]
+    occupied = occupied[bin_counts[occupied] > 0]
+    coords = np.stack(np.unravel_index(occupied, (bins_per_channel,) * 3), axis=1)
+    chosen = []
+    for i in range(len(occupied)):
+        if all(np.abs(coords[i] - coords[j]).max() > 1 for j in chosen):
+            chosen.append(i)
+            if len(chosen) == n_colors:
+                break
+    if len(chosen) < n_colors:
+        chosen += [i for i in range(len(occupied)) if i not in chosen][:n_colors - len(chosen)]
+    top_bins = occupied[chosen]
+    centers = np.stack([
+        np.bincount(bin_index, weights=values[:, c], minlength=n_bins)[top_bins] / bin_counts[top_bins]
+        for c in range(3)
+    ], axis=1)
+
+    # One assignment pass so every pixel belongs to a center and percentages sum to 100
+    distances = ((values[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+    labels = np.argmin(distances, axis=1)
+    counts = np.bincount(labels, minlength=len(centers))
+    keep = counts > 0
+    centers = np.stack([
+        np.bincount(labels, weights=values[:, c], minlength=len(centers))[keep] / counts[keep]
+        for c in range(3)
+    ], axis=1)
+    counts = counts[keep]
+
+    order = np.argsort(counts)[::-1]
+    percentages = counts[order] / len(values) * 100
+    return centers[order].astype(int), percentages
+
 def color_to_name(rgb):
     """
     Convert RGB color to a human-readable color name based on HSV color space.
     """
+    import colorsys
     # Convert RGB to HSV
     r, g, b = rgb[0]/255.0, rgb[1]/255.0, rgb[2]/255.0
     h, s, v = colorsys.rgb_to_hsv(r, g, b)
@@ -312,7 +463,8 @@ def color_to_name(rgb):
     
     return brightness + saturation + color_name
 
-def analyze_reflection(no_reflection_frame, reflection_frame, threshold=20, region_focus='full',debug=False):
+def analyze_reflection(no_reflection_frame, reflection_frame, threshold=20, region_focus='full',debug=False,
+                       include_visuals=True):
     """
     Analyze the reflection by comparing frames with and without reflection.
     
@@ -321,6 +473,8 @@ def analyze_reflection(no_reflection_frame, reflection_frame, threshold=20, regi
     - reflection_frame: Frame with color reflection
     - threshold: Sensitivity threshold for detecting differences
     - region_focus: 'full', 'face', 'forehead', 'cheeks' - region to focus on
+    - include_visuals: build the overlay/heat-map images; when False only the
+      stats, colors and roi are returned
     """
     
     if no_reflection_frame is None or reflection_frame is None:
@@ -332,6 +486,7 @@ def analyze_reflection(no_reflection_frame, reflection_frame, threshold=20, regi
     rf_height, rf_width = reflection_frame.shape[:2]
     
     if debug:
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(15, 10))
         plt.subplot(231)
         plt.imshow(cv2.cvtColor(no_reflection_frame, cv2.COLOR_BGR2RGB))
@@ -347,22 +502,23 @@ def analyze_reflection(no_reflection_frame, reflection_frame, threshold=20, regi
     nrf_face, nrf_coords = extract_face_region(no_reflection_frame)
     rf_face, rf_coords = extract_face_region(reflection_frame)
     
-    # Create face detection visualization
-    nrf_face_vis = no_reflection_frame.copy()
-    rf_face_vis = reflection_frame.copy()
-    
-    # Draw face detection rectangles
-    if nrf_coords:
-        x, y, x2, y2 = nrf_coords
-        cv2.rectangle(nrf_face_vis, (x, y), (x2, y2), (0, 255, 0), 2)
-        cv2.putText(nrf_face_vis, f"Face: {x2-x}x{y2-y}", (x, y-10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-    
-    if rf_coords:
-        x, y, x2, y2 = rf_coords
-        cv2.rectangle(rf_face_vis, (x, y), (x2, y2), (0, 255, 0), 2)
-        cv2.putText(rf_face_vis, f"Face: {x2-x}x{y2-y}", (x, y-10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    if include_visuals or debug:
+        # Create face detection visualization
+        nrf_face_vis = no_reflection_frame.copy()
+        rf_face_vis = reflection_frame.copy()
+        
+        # Draw face detection rectangles
+        if nrf_coords:
+            x, y, x2, y2 = nrf_coords
+            cv2.rectangle(nrf_face_vis, (x, y), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(nrf_face_vis, f"Face: {x2-x}x{y2-y}", (x, y-10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+        
+        if rf_coords:
+            x, y, x2, y2 = rf_coords
+            cv2.rectangle(rf_face_vis, (x, y), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(rf_face_vis, f"Face: {x2-x}x{y2-y}", (x, y-10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
     
     if debug:
         plt.subplot(233)
@@ -416,14 +572,6 @@ def analyze_reflection(no_reflection_frame, reflection_frame, threshold=20, regi
         plt.title('Step 4: Absolute Difference')
         plt.axis('off')
     
-    # Enhance the difference for better visualization
-    diff_enhanced = cv2.convertScaleAbs(diff, alpha=2.0, beta=0)
-    
-    # Create a heat map for better visualization
-    diff_heat = np.sum(diff, axis=2)
-    diff_heat_norm = cv2.normalize(diff_heat, None, 0, 255, cv2.NORM_MINMAX)
-    diff_heat_color = cv2.applyColorMap(diff_heat_norm.astype(np.uint8), cv2.COLORMAP_JET)
-    
     # Threshold the difference to get only significant changes
     mask = np.any(diff > threshold, axis=2)
     diff_masked = np.zeros_like(diff)
@@ -467,6 +615,36 @@ def analyze_reflection(no_reflection_frame, reflection_frame, threshold=20, regi
         'Red': float(channel_means[2])
     }
     
+    # Calculate key statistics for comparison
+    stats = {
+        'reflection_intensity': float(reflection_intensity),
+        'max_channel_diff': float(max_channel_diff),
+        'dominant_channel': channel_names[dominant_channel],
+        'pixel_percentage_affected': float(100 * np.sum(mask) / mask.size),
+        'channel_values': channel_values,
+        'image_resolution': {
+            'base_frame': f"{nrf_width}x{nrf_height}",
+            'reflection_frame': f"{rf_width}x{rf_height}",
+            'face_region': f"{min_width}x{min_height}",
+            'roi': f"{x2-x}x{y2-y}"
+        }
+    }
+    
+    if not include_visuals:
+        return {
+            'reflection_colors': reflection_colors_with_names,
+            'stats': stats,
+            'roi': roi
+        }
+    
+    # Enhance the difference for better visualization
+    diff_enhanced = cv2.convertScaleAbs(diff, alpha=2.0, beta=0)
+    
+    # Create a heat map for better visualization
+    diff_heat = np.sum(diff, axis=2)
+    diff_heat_norm = cv2.normalize(diff_heat, None, 0, 255, cv2.NORM_MINMAX)
+    diff_heat_color = cv2.applyColorMap(diff_heat_norm.astype(np.uint8), cv2.COLORMAP_JET)
+    
     # Create overlay for reflection highlighting
     overlay = rf_face.copy()
     for i in range(3):
@@ -491,21 +669,6 @@ def analyze_reflection(no_reflection_frame, reflection_frame, threshold=20, regi
     alpha_overlay = 0.6
     reflection_highlighted = cv2.addWeighted(rf_face, 1 - alpha_overlay, overlay, alpha_overlay, 0)
     
-    # Calculate key statistics for comparison
-    stats = {
-        'reflection_intensity': float(reflection_intensity),
-        'max_channel_diff': float(max_channel_diff),
-        'dominant_channel': channel_names[dominant_channel],
-        'pixel_percentage_affected': float(100 * np.sum(mask) / mask.size),
-        'channel_values': channel_values,
-        'image_resolution': {
-            'base_frame': f"{nrf_width}x{nrf_height}",
-            'reflection_frame': f"{rf_width}x{rf_height}",
-            'face_region': f"{min_width}x{min_height}",
-            'roi': f"{x2-x}x{y2-y}"
-        }
-    }
-    
     return {
         'no_reflection_face': nrf_face,
         'reflection_face': rf_face,
@@ -532,6 +695,7 @@ def visualize_results(results, save_path=None):
         print("Error: No results to visualize")
         return
     
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(2, 3, figsize=(18, 12))
     fig.patch.set_facecolor('white')  # White background
     
@@ -674,90 +838,350 @@ def combine_analysis_images(image_paths, save_path, titles=None):
     plt.savefig(save_path)
     plt.close(fig)
 
-def compare_all_frames(base_frame_path, colored_frame_paths, user_id, output_dir="results", threshold=20):
+def _region_bounds(width, height, region_focus):
+    """Anatomical ROI inside a face crop, clamped to the crop."""
+    regions = {
+        'full': (0, 0, width, height),
+        'face': (width//6, height//6, width*5//6, height*5//6),
+        'forehead': (width//6, height//6, width*5//6, height//3),
+        'cheeks': (width//6, height//3, width*5//6, height*2//3)
+    }
+    roi = regions.get(region_focus, regions['full'])
+    x, y, x2, y2 = roi
+    x = max(0, min(x, width-1))
+    y = max(0, min(y, height-1))
+    x2 = max(x+1, min(x2, width))
+    y2 = max(y+1, min(y2, height))
+    return roi, (x, y, x2, y2)
+
+def align_face_batch(base_frame, colored_frames):
+    """
+    Detect the base face once and every colored face, then resize all crops to the
+    smallest common size. Returns (base_face (H, W, 3), colored_faces (N, H, W, 3)),
+    or (None, None) if any face region could not be extracted.
+    """
+    base_face, _ = extract_face_region(base_frame)
+    colored_faces = [extract_face_region(frame)[0] for frame in colored_frames]
+    if base_face is None or any(face is None for face in colored_faces):
+        return None, None
+
+    height = min(face.shape[0] for face in [base_face] + colored_faces)
+    width = min(face.shape[1] for face in [base_face] + colored_faces)
+    if height <= 0 or width <= 0:
+        return None, None
+
+    base_face = cv2.resize(base_face, (width, height))
+    aligned = np.empty((len(colored_faces), height, width, 3), dtype=np.uint8)
+    for i, face in enumerate(colored_faces):
+        aligned[i] = face if face.shape[:2] == (height, width) else cv2.resize(face, (width, height))
+    return base_face, aligned
+
+def reflection_features(base_frame, colored_frames, regions=('full',)):
+    """
+    Threshold-independent inputs of the verdict for every region, for parameter sweeps.
+    Faces are aligned once; per region and frame it returns the mean diff ('intensity'),
+    the BGR channel means ('channel_means') and a 256-bin histogram of each pixel's largest
+    channel diff ('max_diff_hist'): pixels affected at threshold t are hist[:, t+1:].sum(axis=1).
+    The values match analyze_reflection_batch. Returns None when a face is missing.
+    """
+    base_face, faces = align_face_batch(base_frame, colored_frames)
+    if base_face is None:
+        return None
+
+    height, width = base_face.shape[:2]
+    count = len(faces)
+    features = {}
+    for region in regions:
+        _, (x, y, x2, y2) = _region_bounds(width, height, region)
+        base_roi = base_face[y:y2, x:x2]
+        colored_roi = faces[:, y:y2, x:x2]
+        diff = np.maximum(colored_roi, base_roi) - np.minimum(colored_roi, base_roi)
+        # One bincount for all frames: frame n's values are offset into bins [256n, 256n + 256)
+        max_diff = diff.max(axis=3).reshape(count, -1).astype(np.int64)
+        max_diff += np.arange(count)[:, None] * 256
+        features[region] = {
+            'intensity': diff.mean(axis=(1, 2, 3)),
+            'channel_means': diff.mean(axis=(1, 2)),
+            'max_diff_hist': np.bincount(max_diff.ravel(), minlength=256 * count).reshape(count, 256),
+        }
+    return features
+
+def analyze_reflection_batch(base_frame, colored_frames, threshold=20, region_focus='full', on_frame=None):
+    """
+    Session-level analyze_reflection: one base face detection, all colored faces aligned into
+    an (N, H, W, 3) array, and diff/mask/intensity/channel means computed for all N frames at once.
+    Returns one dict per colored frame with the same 'stats', 'reflection_colors' and 'roi'
+    as analyze_reflection(include_visuals=False); entries are None for unusable frames.
+    Faces are resized to the smallest face of the whole session rather than of each pair.
+    on_frame(index, analysis, total) is called as each frame's colors are clustered, where
+    total is the number of frames that will be reported.
+    Changes to the result must bump ANALYSIS_VERSION.
+    """
+    if base_frame is None or not colored_frames:
+        return [None] * len(colored_frames)
+
+    valid = [i for i, frame in enumerate(colored_frames) if frame is not None]
+    base_face, faces = align_face_batch(base_frame, [colored_frames[i] for i in valid])
+    if base_face is None:
+        print("Error: Failed to extract face regions")
+        return [None] * len(colored_frames)
+
+    height, width = base_face.shape[:2]
+    roi, (x, y, x2, y2) = _region_bounds(width, height, region_focus)
+    base_roi = base_face[y:y2, x:x2]
+    colored_roi = faces[:, y:y2, x:x2]
+
+    # |a - b| in uint8 without widening: max - min, broadcast over the batch
+    diff = np.maximum(colored_roi, base_roi) - np.minimum(colored_roi, base_roi)
+    mask = np.any(diff > threshold, axis=3)
+    intensities = diff.mean(axis=(1, 2, 3))
+    channel_means = diff.mean(axis=(1, 2))
+    affected = 100 * mask.sum(axis=(1, 2)) / mask[0].size
+    channel_names = ['Blue', 'Green', 'Red']  # BGR order in OpenCV
+
+    results = [None] * len(colored_frames)
+    nrf_height, nrf_width = base_frame.shape[:2]
+    for n, i in enumerate(valid):
+        rf_height, rf_width = colored_frames[i].shape[:2]
+        if mask[n].any():
+            reflection_colors = get_dominant_colors(diff[n][mask[n]], debug=False)
+        else:
+            reflection_colors = []
+        means = channel_means[n]
+        results[i] = {
+            'reflection_colors': [(color, percentage, color_to_name(color)) for color, percentage in reflection_colors],
+            'stats': {
+                'reflection_intensity': float(intensities[n]),
+                'max_channel_diff': float(means.max()),
+                'dominant_channel': channel_names[int(np.argmax(means))],
+                'pixel_percentage_affected': float(affected[n]),
+                'channel_values': {
+                    'Blue': float(means[0]),
+                    'Green': float(means[1]),
+                    'Red': float(means[2])
+                },
+                'image_resolution': {
+                    'base_frame': f"{nrf_width}x{nrf_height}",
+                    'reflection_frame': f"{rf_width}x{rf_height}",
+                    'face_region': f"{width}x{height}",
+                    'roi': f"{x2-x}x{y2-y}"
+                }
+            },
+            'roi': roi
+        }
+        if on_frame:
+            on_frame(i, results[i], len(valid))
+    return results
+
+def _summarize_analysis(color_name, frame_path, analysis):
+    """Essential per-frame results used by the verdict and the summary plot."""
+    return {
+        'color': color_name,
+        'path': frame_path,
+        'intensity': analysis['stats']['reflection_intensity'],
+        'dominant_channel': analysis['stats']['dominant_channel'],
+        'affected_pixels': analysis['stats']['pixel_percentage_affected'],
+        'channel_values': analysis['stats']['channel_values'],
+        'image_resolution': analysis['stats']['image_resolution'],
+        'detected_colors': [(color, pct, name) for color, pct, name in analysis['reflection_colors'] if pct > 5]
+    }
+
+def save_analysis_images(analysis, vis_path, color_name):
+    """
+    Write the per-frame analysis images, resolution info and the combined grid to vis_path.
+    """
+    # Save individual analysis components
+    img_files = []
+    img_titles = []
+    def save_img_and_track(key, title):
+        out_path = os.path.join(vis_path, f"{key}.png")
+        cv2.imwrite(out_path, analysis[key])
+        img_files.append(out_path)
+        img_titles.append(title)
+    save_img_and_track('no_reflection_face', 'Base Face')
+    save_img_and_track('reflection_face', 'Colored Face')
+    save_img_and_track('difference', 'Difference')
+    save_img_and_track('difference_enhanced', 'Enhanced Diff')
+    save_img_and_track('difference_heat', 'Heatmap')
+    save_img_and_track('difference_masked', 'Masked Diff')
+    save_img_and_track('reflection_highlighted', 'Reflection Highlight')
+    save_img_and_track('heat_visualization', 'Heat Visualization')
+    # Face detection overlays
+    cv2.imwrite(os.path.join(vis_path, "face_detection_base.png"), analysis['face_detection']['base_frame'])
+    img_files.append(os.path.join(vis_path, "face_detection_base.png"))
+    img_titles.append('Face Detected (Base)')
+    cv2.imwrite(os.path.join(vis_path, "face_detection_colored.png"), analysis['face_detection']['reflection_frame'])
+    img_files.append(os.path.join(vis_path, "face_detection_colored.png"))
+    img_titles.append('Face Detected (Colored)')
+    # Save resolution info
+    resolution_info = {
+        'image_resolution': analysis['stats']['image_resolution'],
+        'timestamp': datetime.datetime.now().isoformat()
+    }
+    with open(os.path.join(vis_path, "resolution_info.json"), 'w') as f:
+        json.dump(resolution_info, f, indent=4)
+    # Combine all images for this color into a grid
+    combined_path = os.path.join(vis_path, f"combined_{color_name}.png")
+    combine_analysis_images(img_files, combined_path, img_titles)
+
+def compare_all_frames(base_frame_path, colored_frame_paths, user_id, output_dir="results", threshold=20, render=True,
+                       region_focus='full', on_result=None):
     """
     Compare a base frame with multiple colored frames and generate analysis for each.
-    Now saves results in a user-specific folder and combines all analysis images for each color.
+    Loads the frames from disk (the color is the last "_" part of the file name) and
+    hands them to compare_frames.
     """
-    import json, datetime
-    # Create user-specific visualization directory
-    user_vis_dir = os.path.join("data", "visualization", f"{user_id}_analysis")
-    os.makedirs(user_vis_dir, exist_ok=True)
-    
     # Load base frame
     base_frame = cv2.imread(base_frame_path)
     if base_frame is None:
         print(f"Error: Could not load base frame from {base_frame_path}")
         return None
-    
-    results = []
+
+    colored_frames = []
     for frame_path in colored_frame_paths:
-        try:
-            color_name = Path(frame_path).stem.split('_')[-1]
-            vis_path = os.path.join(user_vis_dir, f"analysis_{color_name}")
-            os.makedirs(vis_path, exist_ok=True)
-            
-            colored_frame = cv2.imread(frame_path)
-            if colored_frame is None:
-                print(f"Error: Could not load colored frame from {frame_path}")
+        colored_frame = cv2.imread(frame_path)
+        if colored_frame is None:
+            print(f"Error: Could not load colored frame from {frame_path}")
+            continue
+        colored_frames.append((Path(frame_path).stem.split('_')[-1], frame_path, colored_frame))
+    return compare_frames(base_frame, colored_frames, user_id, threshold=threshold, render=render,
+                          region_focus=region_focus, on_result=on_result)
+
+def compare_frames(base_frame, colored_frames, user_id, threshold=20, render=True, region_focus='full', on_result=None):
+    """
+    Compare a decoded base frame with decoded colored frames, given as (color_name, label, image)
+    where label identifies the frame in the results ('path').
+    Now saves results in a user-specific folder and combines all analysis images for each color.
+    With render=False only the numeric stats are computed and nothing is written to disk.
+    on_result(summary, total) is called with each frame's summary as soon as it is ready, where
+    total counts the frames that get a summary; on_result(None, total) reports a lower total
+    when a frame turns out to be unusable after earlier frames were reported.
+    """
+    # Create user-specific visualization directory
+    user_vis_dir = os.path.join("data", "visualization", f"{user_id}_analysis")
+    if render:
+        os.makedirs(user_vis_dir, exist_ok=True)
+
+    if not render:
+        # Fast path: all frames analyzed together, nothing written to disk
+        summaries = {}
+
+        def summarize(index, analysis, total):
+            color_name, label, _ = colored_frames[index]
+            summaries[index] = _summarize_analysis(color_name, label, analysis)
+            if on_result:
+                on_result(summaries[index], total)
+
+        analyses = analyze_reflection_batch(base_frame, [image for _, _, image in colored_frames], threshold=threshold,
+                                            region_focus=region_focus, on_frame=summarize)
+        results = []
+        for index, ((_, label, _), analysis) in enumerate(zip(colored_frames, analyses)):
+            if analysis is None:
+                print(f"Error: Analysis failed for {label}")
                 continue
-            analysis = analyze_reflection(base_frame, colored_frame, threshold=threshold)
+            results.append(summaries[index])
+        return results
+
+    results = []
+    # Frames are analysed one by one here, so failures only lower the total as they happen
+    total = len(colored_frames)
+
+    def skip():
+        nonlocal total
+        total -= 1
+        if on_result:
+            on_result(None, total)
+
+    for color_name, label, colored_frame in colored_frames:
+        try:
+            analysis = analyze_reflection(base_frame, colored_frame, threshold=threshold, region_focus=region_focus)
             if analysis is None:
-                print(f"Error: Analysis failed for {frame_path}")
+                print(f"Error: Analysis failed for {label}")
+                skip()
                 continue
-            # Save individual analysis components
-            img_files = []
-            img_titles = []
-            def save_img_and_track(key, title):
-                out_path = os.path.join(vis_path, f"{key}.png")
-                cv2.imwrite(out_path, analysis[key])
-                img_files.append(out_path)
-                img_titles.append(title)
-            save_img_and_track('no_reflection_face', 'Base Face')
-            save_img_and_track('reflection_face', 'Colored Face')
-            save_img_and_track('difference', 'Difference')
-            save_img_and_track('difference_enhanced', 'Enhanced Diff')
-            save_img_and_track('difference_heat', 'Heatmap')
-            save_img_and_track('difference_masked', 'Masked Diff')
-            save_img_and_track('reflection_highlighted', 'Reflection Highlight')
-            save_img_and_track('heat_visualization', 'Heat Visualization')
-            # Face detection overlays
-            cv2.imwrite(os.path.join(vis_path, "face_detection_base.png"), analysis['face_detection']['base_frame'])
-            img_files.append(os.path.join(vis_path, "face_detection_base.png"))
-            img_titles.append('Face Detected (Base)')
-            cv2.imwrite(os.path.join(vis_path, "face_detection_colored.png"), analysis['face_detection']['reflection_frame'])
-            img_files.append(os.path.join(vis_path, "face_detection_colored.png"))
-            img_titles.append('Face Detected (Colored)')
-            # Save resolution info
-            resolution_info = {
-                'image_resolution': analysis['stats']['image_resolution'],
-                'timestamp': datetime.datetime.now().isoformat()
-            }
-            with open(os.path.join(vis_path, "resolution_info.json"), 'w') as f:
-                json.dump(resolution_info, f, indent=4)
-            # Combine all images for this color into a grid
-            combined_path = os.path.join(vis_path, f"combined_{color_name}.png")
-            combine_analysis_images(img_files, combined_path, img_titles)
+            vis_path = os.path.join(user_vis_dir, f"analysis_{color_name}")
+            os.makedirs(vis_path, exist_ok=True)
+            with _render_lock:
+                save_analysis_images(analysis, vis_path, color_name)
             # Extract essential results for summary
-            summary = {
-                'color': color_name,
-                'path': frame_path,
-                'intensity': analysis['stats']['reflection_intensity'],
-                'dominant_channel': analysis['stats']['dominant_channel'],
-                'affected_pixels': analysis['stats']['pixel_percentage_affected'],
-                'channel_values': analysis['stats']['channel_values'],
-                'image_resolution': analysis['stats']['image_resolution'],
-                'detected_colors': [(color, pct, name) for color, pct, name in analysis['reflection_colors'] if pct > 5]
-            }
-            results.append(summary)
+            results.append(_summarize_analysis(color_name, label, analysis))
+            if on_result:
+                on_result(results[-1], total)
         except Exception as e:
-            print(f"Error processing {frame_path}: {e}")
+            print(f"Error processing {label}: {e}")
+            skip()
     # Generate and save summary visualization
-    if results:
+    if results and render:
         summary_path = os.path.join(user_vis_dir, "summary_analysis.png")
-        generate_summary_visualization(results, summary_path)
+        with _render_lock:
+            generate_summary_visualization(results, summary_path)
     return results
 
+# Bump whenever decide_injection changes, so cached verdicts are recomputed
+DECISION_RULE_VERSION = 1
+# Genuine when at least this share of frames shows the expected channel...
+MATCH_CUTOFF = 0.5
+# ...or the reflection intensity consistency (%) is above this
+CONSISTENCY_CUTOFF = 50
+
+# Dominant channel each screen color is expected to produce on the face
+EXPECTED_CHANNELS = {
+    'Blue': 'Blue', 'Blue2': 'Blue',
+    'Red': 'Red',
+    'Green': 'Green', 'Green2': 'Green',
+    'Yellow': 'Red',  # Yellow often appears as high in red channel
+    'Cyan': 'Green'   # Cyan often appears as high in green/blue
+}
+
+def decide_injection(results):
+    """
+    Verdict from compare_frames results: the video is genuine when at least half
+    the frames show the expected dominant channel or the reflection intensity is consistent.
+    Returns {"is_injected": bool, "analysis": {...}} with the metrics behind the decision.
+    """
+    intensities = [r['intensity'] for r in results]
+    consistency = 100 * (1 - (max(intensities) - min(intensities)) / max(intensities))
+
+    matches = sum(1 for r in results if r['dominant_channel'] == EXPECTED_CHANNELS.get(r['color'], ''))
+    match_percentage = (matches / len(results)) * 100
+
+    is_injected = not (matches >= len(results) * MATCH_CUTOFF or consistency > CONSISTENCY_CUTOFF)
+    return {
+        "is_injected": is_injected,
+        "analysis": {
+            "consistency": consistency,
+            "match_percentage": match_percentage,
+            "total_frames_analyzed": len(results),
+            "frames_matching_expected": matches,
+            "intensity_range": {
+                "min": min(intensities),
+                "max": max(intensities)
+            },
+            "frame_details": [frame_detail(r) for r in results]
+        }
+    }
+
+def frame_detail(result):
+    """The part of a compare_frames result that goes into the analysis record."""
+    return {
+        "color": result['color'],
+        "intensity": result['intensity'],
+        "dominant_channel": result['dominant_channel'],
+        "affected_pixels": result['affected_pixels'],
+        "channel_values": result['channel_values']
+    }
+
+def analysis_parameters(threshold=20, region_focus='full'):
+    """Everything besides the frames that changes a verdict; part of the analysis cache key."""
+    return {
+        "threshold": threshold,
+        "region": region_focus,
+        "decision_rule": DECISION_RULE_VERSION,
+        "analysis": ANALYSIS_VERSION,
+        "face_detector": FACE_DETECTOR,
+        "face_detection_max_dim": FACE_DETECTION_MAX_DIM,
+    }
+
 def generate_summary_visualization(results, output_path):
     """
     Generate a summary visualization comparing all frames.
@@ -770,6 +1194,7 @@ def generate_summary_visualization(results, output_path):
     results.sort(key=lambda x: x['color'])
     
     # Set up the figure
+    import matplotlib.pyplot as plt
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(18, 10))
     fig.patch.set_facecolor('white')
     